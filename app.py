@@ -1,25 +1,36 @@
-from flask import Flask, render_template_string, request, redirect, abort
+from flask import Flask, Response, render_template_string, request, redirect, abort, jsonify, stream_with_context, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, UserMixin, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from markupsafe import escape
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 from functools import wraps
+import hashlib
 import os
 
 # モデルとDBをインポート
-from models import db, User
+from models import db, User, RunSummary
+from instrumentation import render_prometheus
+from subscriptions import sync_user_subscriptions, sync_user_strategies, user_strategies, parse_symbols, STRATEGY_NAMES
+from snapshots import SnapshotCache
+from user_io import export_csv, export_json, import_users, read_records
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "devkey")
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL", "sqlite:///users.db")
+USERS_PAGE_SIZE = int(os.environ.get("USERS_PAGE_SIZE", "100"))
+USERS_PAGE_MAX = 1000
 db.init_app(app)
+with app.app_context():
+    db.create_all()
 
 login_manager = LoginManager(app)
 limiter = Limiter(get_remote_address, app=app, default_limits=["200/day", "50/hour"])
+snapshot_cache = SnapshotCache()
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -71,6 +82,8 @@ def dashboard():
         current_user.email = request.form["email"]
         current_user.symbols = request.form["symbols"]
         current_user.notify_enabled = "notify_enabled" in request.form
+        sync_user_subscriptions(db.session, current_user)
+        sync_user_strategies(db.session, current_user, request.form.getlist("strategies"))
         db.session.commit()
         return redirect("/dashboard")
 
@@ -81,10 +94,34 @@ def dashboard():
             銘柄コード（改行で複数）：<br>
             <textarea name="symbols" rows="5" cols="30">{{ user.symbols }}</textarea><br>
             通知ON：<input type="checkbox" name="notify_enabled" {% if user.notify_enabled %}checked{% endif %}><br>
+            受け取る戦略（未選択ならすべて）：<br>
+            {% for name in strategy_names %}
+            <label><input type="checkbox" name="strategies" value="{{ name }}" {% if not chosen or name in chosen %}checked{% endif %}>{{ name }}</label><br>
+            {% endfor %}
             <input type="submit" value="保存">
         </form>
+        <p><a href='/api/signals'>最新の指標・シグナル（JSON）</a></p>
         <p><a href='/logout'>ログアウト</a></p>
-    """, user=current_user)
+    """, user=current_user, strategy_names=STRATEGY_NAMES, chosen=user_strategies(db.session, current_user.id))
+
+# 📸 登録銘柄の最新の指標・シグナル（スナップショット表から返す。表の版で ETag / Last-Modified を付けて再検証）
+@app.route("/api/signals")
+@login_required
+def api_signals():
+    version, run_id, updated_at, rows = snapshot_cache.current(db.session)
+    symbols = parse_symbols(current_user.symbols)
+    response = jsonify({
+        "run_id": run_id,
+        "updated_at": updated_at.isoformat() + "Z" if updated_at else None,
+        "symbols": [rows.get(sym) or {"symbol": sym, "indicators": None, "signal": None} for sym in symbols],
+    })
+    response.set_etag(hashlib.sha1(f"{version}:{','.join(symbols)}".encode()).hexdigest())
+    if updated_at:
+        response.last_modified = updated_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response.make_conditional(request)
 
 @app.route("/register", methods=["GET", "POST"])
 # @admin_required  # 管理者のみ有効にしたい場合ここを有効に
@@ -115,17 +152,79 @@ def register():
 @app.route("/users")
 @admin_required
 def show_users():
-    users = User.query.all()
-    html = "<h2>登録済みユーザー一覧</h2><ul>"
-    for u in users:
-        html += f"""
-        <li>{u.username} - {u.role}
+    # 🔎 ユーザー名の前方一致検索 + id のキーセットでページ送り（OFFSET を使わないので深いページでも一定コスト）
+    q = request.args.get("q", "").strip()
+    after = request.args.get("after", 0, type=int)
+    limit = max(1, min(request.args.get("limit", USERS_PAGE_SIZE, type=int), USERS_PAGE_MAX))
+    query = db.session.query(User.id, User.username, User.role).filter(User.id > after)
+    if q:
+        query = query.filter(User.username.startswith(q, autoescape=True))
+    rows = query.order_by(User.id).limit(limit + 1).all()
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    rows = rows[:limit]
+
+    def generate():
+        yield render_template_string("""
+        <h2>登録済みユーザー一覧</h2>
+        <form method='GET'>
+            ユーザー名で検索：<input name='q' value='{{ q }}'>
+            <input type='submit' value='検索'>
+        </form>
+        <p><a href='/users/import'>📥一括登録</a> / <a href='/users/export?format=csv'>📤CSV</a> / <a href='/users/export?format=json'>📤JSON</a></p>
+        <ul>
+        """, q=q)
+        for u in rows:
+            yield f"""
+        <li>{escape(u.username)} - {escape(u.role)}
             <a href='/delete_user/{u.id}' onclick="return confirm('本当に削除しますか？');">🗑削除</a>
             <a href='/change_password/{u.id}'>🔑パスワード変更</a>
         </li>
         """
-    html += "</ul>"
-    return html
+        yield "</ul>"
+        if next_after is not None:
+            yield f"<p><a href='{escape(url_for('show_users', q=q or None, after=next_after, limit=limit))}'>次へ →</a></p>"
+
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
+# 📤 ユーザーと登録銘柄の一括書き出し（id 順に分割して読みながら送る）
+@app.route("/users/export")
+@admin_required
+def export_users_view():
+    fmt = "json" if request.args.get("format") == "json" else "csv"
+    body = export_json(db.session) if fmt == "json" else export_csv(db.session)
+    return Response(stream_with_context(body),
+                    mimetype="application/json" if fmt == "json" else "text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=users.{fmt}"})
+
+# 📥 CSV / JSON からユーザーを一括作成・更新（既存ユーザー名は上書き）
+@app.route("/users/import", methods=["GET", "POST"])
+@admin_required
+def import_users_view():
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if upload is None or not upload.filename:
+            return "ファイルを指定してください", 400
+        fmt = "json" if upload.filename.lower().endswith(".json") else "csv"
+        try:
+            records = read_records(upload.read().decode("utf-8-sig"), fmt)
+        except ValueError as e:
+            return f"読み込みに失敗しました: {escape(str(e))}", 400
+        report = import_users(db.session, records)
+        return render_template_string("""
+            <h2>一括登録の結果</h2>
+            <p>作成 {{ r.created }}件 / 更新 {{ r.updated }}件 / エラー {{ r.errors|length }}件</p>
+            <ul>{% for e in r.errors %}<li>{{ e }}</li>{% endfor %}</ul>
+            <p><a href='/users'>ユーザー一覧へ</a></p>
+        """, r=report)
+
+    return render_template_string("""
+        <h1>ユーザー一括登録</h1>
+        <p>列：username, email, role, notify_enabled, symbols（空白区切り）, strategies（空白区切り）, password または password_hash<br>空欄の列は変更しません。登録銘柄を空にする・戦略をすべてに戻すときは - を指定します</p>
+        <form method='POST' enctype='multipart/form-data'>
+            <input type='file' name='file' accept='.csv,.json'><br>
+            <input type='submit' value='取り込み'>
+        </form>
+    """)
 
 @app.route("/delete_user/<int:user_id>")
 @admin_required
@@ -157,5 +256,14 @@ def change_password(user_id):
         </form>
     """)
 
+@app.route("/metrics")
+@limiter.exempt
+def metrics():
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(403)
+    latest = RunSummary.query.order_by(RunSummary.finished_at.desc()).first()
+    return Response(render_prometheus(latest), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(debug=True)
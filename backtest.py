@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import sys
+import time as time_module
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from run_bot import TIME_STRATEGY_MAP, STRATEGIES, BAR_CACHE_PATH
+from bar_cache import BarCache
+from vectorized import BarPanel
+
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "1"))
+BACKTEST_CHUNK_SIZE = int(os.getenv("BACKTEST_CHUNK_SIZE", "128"))
+BACKTEST_HORIZONS = os.getenv("BACKTEST_HORIZONS", "1,6,12")
+
+
+# 戦略 → 実行時刻（TIME_STRATEGY_MAP の逆引き、最初の実行時刻順）
+def strategy_slots():
+    slots = {}
+    for t, name in sorted(TIME_STRATEGY_MAP.items()):
+        slots.setdefault(name, []).append(t)
+    return slots
+
+
+def interval_minutes(interval):
+    return int(interval[:-1]) if interval.endswith("m") else None
+
+
+# 実行時刻までに確定している最後の足の開始時刻（分）。未確定足の終値を使う先読みを避ける
+def slot_bar_minutes(slot, step):
+    hour, minute = map(int, slot.split(":"))
+    return (hour * 60 + minute - step) // step * step
+
+
+# 📊 フォワードリターンの集計（件数・合計・二乗和・プラス件数だけを持ち、シャード間で足し合わせる）
+class ReturnStats:
+    __slots__ = ("count", "total", "total_sq", "wins")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.wins = 0
+
+    def add(self, values):
+        values = values[np.isfinite(values)]
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.total_sq += float(np.square(values).sum())
+        self.wins += int((values > 0).sum())
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.wins += other.wins
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0, "mean": None, "std": None, "hit_rate": None}
+        mean = self.total / self.count
+        var = max(self.total_sq / self.count - mean * mean, 0.0)
+        return {"count": self.count, "mean": mean, "std": var ** 0.5, "hit_rate": self.wins / self.count}
+
+
+def forward_returns(close, horizon):
+    out = np.full(close.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[:, :-horizon] = close[:, horizon:] / close[:, :-horizon] - 1
+    return out
+
+
+def _empty_scope(horizons):
+    return {"bars": 0, "signals": 0,
+            "signal": {h: ReturnStats() for h in horizons},
+            "baseline": {h: ReturnStats() for h in horizons}}
+
+
+# ワーカー側：担当銘柄の全期間の足を読み込み、全戦略を一括評価して集計値だけを返す
+def _backtest_chunk(task):
+    path, interval, symbols, slots, horizons = task
+    bar_cache = BarCache(path)
+    try:
+        frames = {sym: bar_cache.load(sym, interval, days=None) for sym in symbols}
+    finally:
+        bar_cache.close()
+    panel = BarPanel.from_frames(frames)
+    if len(panel) == 0:
+        return {}, 0
+
+    width = panel.close.shape[1]
+    minutes = np.full(panel.close.shape, -1, dtype=np.int64)
+    for row, sym in enumerate(panel.symbols):
+        index = frames[sym].index
+        minutes[row, width - len(index):] = index.hour * 60 + index.minute
+
+    returns = {h: forward_returns(panel.close, h) for h in horizons}
+    observed = ~np.isnan(panel.close)
+    step = interval_minutes(interval)
+    memo = {}
+    results = {}
+    for name, times in slots.items():
+        signals = STRATEGIES[name].backtest(panel, memo)
+        scopes = {"all": observed}
+        if step:
+            scopes["scheduled"] = observed & np.isin(minutes, [slot_bar_minutes(t, step) for t in times])
+        results[name] = {}
+        for scope, bars in scopes.items():
+            hits = signals & bars
+            acc = _empty_scope(horizons)
+            acc["bars"] = int(bars.sum())
+            acc["signals"] = int(hits.sum())
+            for h, fwd in returns.items():
+                acc["signal"][h].add(fwd[hits])
+                acc["baseline"][h].add(fwd[bars])
+            results[name][scope] = acc
+    return results, int(observed.sum())
+
+
+def _merge(total, part, horizons):
+    for name, scopes in part.items():
+        for scope, acc in scopes.items():
+            into = total.setdefault(name, {}).setdefault(scope, _empty_scope(horizons))
+            into["bars"] += acc["bars"]
+            into["signals"] += acc["signals"]
+            for h in horizons:
+                into["signal"][h].merge(acc["signal"][h])
+                into["baseline"][h].merge(acc["baseline"][h])
+
+
+# 🧪 ローカルの足データ全期間で全戦略を一括バックテスト
+def run_backtest(path=BAR_CACHE_PATH, interval="5m", symbols=None, strategies=None,
+                 horizons=(1, 6, 12), workers=BACKTEST_WORKERS, chunk_size=BACKTEST_CHUNK_SIZE):
+    slots = strategy_slots()
+    if strategies:
+        slots = {name: times for name, times in slots.items() if name in strategies}
+    if symbols is None:
+        bar_cache = BarCache(path)
+        symbols = bar_cache.symbols(interval)
+        bar_cache.close()
+
+    tasks = [(path, interval, symbols[i:i + chunk_size], slots, tuple(horizons))
+             for i in range(0, len(symbols), chunk_size)]
+    started = time_module.perf_counter()
+    total, n_bars = {}, 0
+    if workers <= 1:
+        parts = map(_backtest_chunk, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        parts = pool.map(_backtest_chunk, tasks)
+    try:
+        for done, (part, bars) in enumerate(parts, 1):
+            _merge(total, part, horizons)
+            n_bars += bars
+            print(f"🧪 {done}/{len(tasks)} シャード完了（{n_bars}本）", file=sys.stderr, flush=True)
+    finally:
+        if workers > 1:
+            pool.shutdown()
+
+    strategies_out = {}
+    for name, times in slots.items():
+        scopes = {}
+        for scope, acc in total.get(name, {}).items():
+            scopes[scope] = {
+                "bars": acc["bars"],
+                "signals": acc["signals"],
+                "signal_rate": acc["signals"] / acc["bars"] if acc["bars"] else None,
+                "forward_returns": {str(h): acc["signal"][h].summary() for h in horizons},
+                "baseline": {str(h): acc["baseline"][h].summary() for h in horizons},
+            }
+        strategies_out[name] = {"slots": times, **scopes}
+    return {
+        "interval": interval,
+        "symbols": len(symbols),
+        "bars": n_bars,
+        "horizons": list(horizons),
+        "elapsed_seconds": time_module.perf_counter() - started,
+        "strategies": strategies_out,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ローカルの足データで全戦略をバックテスト")
+    parser.add_argument("--db", default=BAR_CACHE_PATH)
+    parser.add_argument("--interval", default="5m")
+    parser.add_argument("--symbols", default=None, help="カンマ区切りのティッカー（省略時はキャッシュ内の全銘柄）")
+    parser.add_argument("--strategy", action="append", help="対象戦略（複数指定可、省略時は全戦略）")
+    parser.add_argument("--horizons", default=BACKTEST_HORIZONS, help="フォワードリターンの足数（カンマ区切り）")
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BACKTEST_CHUNK_SIZE)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+
+    symbols = args.symbols.split(",") if args.symbols else None
+    horizons = [int(h) for h in args.horizons.split(",")]
+    report = run_backtest(args.db, args.interval, symbols, args.strategy, horizons, args.workers, args.chunk_size)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import sqlite3
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BAR_COLUMNS, BarStore
+
+
+# 💾 銘柄×足種ごとの OHLCV を SQLite に保存し、差分取得を可能にするキャッシュ
+class BarCache:
+    def __init__(self, path="bars.db", tz="Asia/Tokyo", check_same_thread=True):
+        self.tz = tz
+        self.conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bars (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                open REAL, high REAL, low REAL, close REAL, volume REAL,
+                PRIMARY KEY (symbol, interval, ts)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def last_timestamps(self, symbols, interval):
+        rows = self.conn.execute(
+            "SELECT symbol, MAX(ts) FROM bars WHERE interval = ? GROUP BY symbol", (interval,)
+        ).fetchall()
+        wanted = set(symbols)
+        return {
+            sym: pd.Timestamp(ts, unit="s", tz="UTC").tz_convert(self.tz)
+            for sym, ts in rows if sym in wanted
+        }
+
+    # 同一タイムスタンプは上書き（直近の未確定足を最新値で置き換える）
+    def upsert(self, symbol, interval, df):
+        if df is None or df.empty:
+            return 0
+        df = df[BAR_COLUMNS].dropna(how="all")
+        index = df.index if df.index.tz is not None else df.index.tz_localize(self.tz)
+        ts = index.tz_convert("UTC").as_unit("s").asi8
+        rows = [
+            (symbol, interval, int(t), *map(_float_or_none, values))
+            for t, values in zip(ts, df.itertuples(index=False, name=None))
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return len(rows)
+
+    def symbols(self, interval):
+        rows = self.conn.execute("SELECT DISTINCT symbol FROM bars WHERE interval = ? ORDER BY symbol", (interval,))
+        return [sym for (sym,) in rows]
+
+    # 直近 days 営業日ぶんの足を読み込む（yfinance の period="5d" 相当。days=None なら全期間）
+    def load(self, symbol, interval, days=5):
+        rows = self.conn.execute(
+            "SELECT ts, open, high, low, close, volume FROM bars "
+            "WHERE symbol = ? AND interval = ? ORDER BY ts", (symbol, interval)
+        ).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        df = pd.DataFrame(rows, columns=["ts"] + BAR_COLUMNS)
+        df.index = pd.to_datetime(df.pop("ts"), unit="s", utc=True).dt.tz_convert(self.tz)
+        df.index.name = "Datetime"
+        if days is None:
+            return df
+        dates = df.index.normalize()
+        keep = dates.unique()[-days:]
+        return df[dates.isin(keep)]
+
+    # DataFrame を経由せずに直近 days 営業日ぶんを配列で読み込む（BarStore 用）
+    def load_arrays(self, symbol, interval, days=5):
+        rows = self.conn.execute(
+            "SELECT ts, open, high, low, close, volume FROM bars "
+            "WHERE symbol = ? AND interval = ? ORDER BY ts", (symbol, interval)
+        ).fetchall()
+        if not rows:
+            return None
+        data = np.array(rows, dtype=np.float64)
+        ts = data[:, 0].astype(np.int64)
+        if days is not None:
+            dates = pd.to_datetime(ts, unit="s", utc=True).tz_convert(self.tz).normalize().asi8
+            keep = np.isin(dates, np.unique(dates)[-days:])
+            data, ts = data[keep], ts[keep]
+        return symbol, ts, data[:, 1:5].astype(np.float32), np.nan_to_num(data[:, 5]).astype(np.int64)
+
+    def load_store(self, symbols, interval, days=5):
+        parts = (self.load_arrays(sym, interval, days) for sym in symbols)
+        return BarStore.from_arrays((p for p in parts if p is not None), tz=self.tz)
+
+    # 保持期間を過ぎた足を削除
+    def evict(self, retention_days, now=None):
+        now = now or pd.Timestamp.now(tz="UTC")
+        cutoff = int((now - timedelta(days=retention_days)).timestamp())
+        deleted = self.conn.execute("DELETE FROM bars WHERE ts < ?", (cutoff,)).rowcount
+        self.conn.commit()
+        return deleted
+
+
+def _float_or_none(value):
+    return None if pd.isna(value) else float(value)
+
+
+# 🔄 キャッシュ済み銘柄は最終足以降のみ、未キャッシュ銘柄は period 分を取得する計画を立てる
+def plan_incremental(bar_cache, symbols, interval="5m", period="5d"):
+    last = bar_cache.last_timestamps(symbols, interval)
+    plans = []
+    fresh = [s for s in symbols if s not in last]
+    if fresh:
+        plans.append((fresh, {"period": period, "interval": interval}))
+    groups = {}
+    for sym in symbols:
+        if sym in last:
+            groups.setdefault(last[sym].date(), []).append(sym)
+    for syms in groups.values():
+        plans.append((syms, {"interval": interval, "start": min(last[s] for s in syms)}))
+    return last, plans
+
+
+def fetch_incremental(fetcher, bar_cache, symbols, interval="5m", period="5d", days=5):
+    last, plans = plan_incremental(bar_cache, symbols, interval, period)
+    failed = []
+    for syms, kwargs in plans:
+        result = fetcher.fetch(syms, **kwargs)
+        for sym, df in result.data.items():
+            bar_cache.upsert(sym, interval, df)
+        failed += result.failed
+
+    stale = [s for s in failed if s in last]
+    if stale:
+        print(f"⚠️ 差分取得に失敗した{len(stale)}件はキャッシュ済みの足で続行します", flush=True)
+
+    return bar_cache.load_store(symbols, interval, days=days), [s for s in failed if s not in last]
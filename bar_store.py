@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+PRICE_COLUMNS = BAR_COLUMNS[:4]
+
+
+# 🗜 全銘柄の足を1本の連続配列に詰めた列指向ストア
+# 価格は float32、出来高は int64、時刻は全銘柄共通の軸への位置（int32）で持ち、
+# 銘柄ごとの行は [start, stop) の連続区間なので切り出しはコピーなしのビューになる
+class BarStore:
+    def __init__(self, symbols, offsets, prices, volume, ts_pos, timestamps, tz="Asia/Tokyo"):
+        self.symbols = symbols
+        self.offsets = offsets
+        self.prices = prices
+        self.volume = volume
+        self.ts_pos = ts_pos
+        self.timestamps = timestamps
+        self.tz = tz
+        self._rows = {sym: i for i, sym in enumerate(symbols)}
+
+    # parts: (銘柄, UTC秒の配列, (本数, 4) の価格配列, 出来高配列) の列
+    @classmethod
+    def from_arrays(cls, parts, tz="Asia/Tokyo"):
+        parts = sorted((p for p in parts if len(p[1])), key=lambda p: p[0])
+        symbols = [p[0] for p in parts]
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p[1]) for p in parts])
+        total = int(offsets[-1])
+
+        prices = np.empty((len(PRICE_COLUMNS), total), dtype=np.float32)
+        volume = np.empty(total, dtype=np.int64)
+        ts = np.empty(total, dtype=np.int64)
+        # 詰め終えた銘柄の一時配列はすぐ手放す（np.empty のページは書き込み時に確保されるのでピークは1倍強で済む）
+        for i in range(len(parts)):
+            _, sym_ts, sym_prices, sym_volume = parts[i]
+            parts[i] = None
+            start, stop = offsets[i], offsets[i + 1]
+            prices[:, start:stop] = np.asarray(sym_prices).T
+            volume[start:stop] = sym_volume
+            ts[start:stop] = sym_ts
+            del sym_ts, sym_prices, sym_volume
+        timestamps = np.unique(ts)
+        ts_pos = np.searchsorted(timestamps, ts).astype(np.int32)
+        return cls(symbols, offsets, prices, volume, ts_pos, timestamps, tz)
+
+    @classmethod
+    def from_frames(cls, frames, tz="Asia/Tokyo"):
+        parts = []
+        for sym, df in frames.items():
+            if df is None or df.empty:
+                continue
+            index = df.index if df.index.tz is not None else df.index.tz_localize(tz)
+            parts.append((sym, index.tz_convert("UTC").as_unit("s").asi8,
+                          df[PRICE_COLUMNS].to_numpy(dtype=np.float32),
+                          np.nan_to_num(df["Volume"].to_numpy(dtype=np.float64)).astype(np.int64)))
+        return cls.from_arrays(parts, tz)
+
+    @property
+    def nbytes(self):
+        return self.prices.nbytes + self.volume.nbytes + self.ts_pos.nbytes + self.timestamps.nbytes
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self._rows
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __getitem__(self, symbol):
+        row = self._rows[symbol]
+        return SymbolBars(self, symbol, int(self.offsets[row]), int(self.offsets[row + 1]))
+
+    def get(self, symbol, default=None):
+        return self[symbol] if symbol in self._rows else default
+
+    def items(self):
+        for symbol in self.symbols:
+            yield symbol, self[symbol]
+
+
+# 1銘柄ぶんのビュー（検出関数からは DataFrame と同じように列を読める。列はコピーなし）
+class SymbolBars:
+    __slots__ = ("store", "symbol", "start", "stop", "_index")
+
+    columns = BAR_COLUMNS
+
+    def __init__(self, store, symbol, start, stop):
+        self.store = store
+        self.symbol = symbol
+        self.start = start
+        self.stop = stop
+        self._index = None
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def empty(self):
+        return self.stop == self.start
+
+    @property
+    def index(self):
+        if self._index is None:
+            ts = self.store.timestamps[self.store.ts_pos[self.start:self.stop]]
+            index = pd.DatetimeIndex(pd.to_datetime(ts, unit="s", utc=True)).tz_convert(self.store.tz)
+            self._index = index.rename("Datetime")
+        return self._index
+
+    # 直近 n 本だけのビュー（コピーなし）
+    def tail(self, n):
+        return SymbolBars(self.store, self.symbol, max(self.start, self.stop - n), self.stop)
+
+    def values(self, column):
+        if column == "Volume":
+            return self.store.volume[self.start:self.stop]
+        return self.store.prices[PRICE_COLUMNS.index(column), self.start:self.stop]
+
+    def __getitem__(self, column):
+        return pd.Series(self.values(column), index=self.index, name=column, copy=False)
+
+    # pandas 互換（こちらはコピーを作る。デバッグ出力や差分抽出用）
+    def copy(self):
+        return pd.DataFrame({col: self.values(col) for col in BAR_COLUMNS}, index=self.index)
+
+    # after より新しい足を (時刻, 始値, 高値, 安値, 終値, 出来高) で返す
+    def rows(self, after=None):
+        index = self.index
+        first = 0 if after is None else int(index.searchsorted(after, side="right"))
+        columns = [self.values(col)[first:].tolist() for col in BAR_COLUMNS]
+        return list(zip(index[first:], *columns))
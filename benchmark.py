@@ -0,0 +1,326 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time as time_module
+import tracemalloc
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+# run_bot の import 前にローカル DB / キャッシュを差し込む
+WORKDIR = tempfile.mkdtemp(prefix="cross-notifier-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ["BAR_CACHE_PATH"] = os.path.join(WORKDIR, "bars.db")
+
+import run_bot  # noqa: E402
+from bar_cache import BarCache, fetch_incremental  # noqa: E402
+from executor import ShardedEvaluator  # noqa: E402
+from fetcher import AdaptiveRateLimiter, BatchFetcher  # noqa: E402
+from market_data import RecordingProvider, ReplayProvider  # noqa: E402
+from indicators import IndicatorEngine  # noqa: E402
+from models import db, User, Subscription, SentNotification  # noqa: E402
+from notifier import Dispatcher, FakeBackend  # noqa: E402
+from subscriptions import build_symbol_index, fan_out  # noqa: E402
+from symbol_directory import SymbolDirectory  # noqa: E402
+
+DETECTORS = {name: strategy.detect for name, strategy in run_bot.STRATEGIES.items()}
+
+
+# 📈 合成 5分足（東証の前場/後場 66本 × days 営業日のランダムウォーク）
+def synthetic_bars(n_symbols, days=5, seed=0):
+    rng = np.random.default_rng(seed)
+    sessions = []
+    for day in pd.bdate_range(end=pd.Timestamp.now(tz="Asia/Tokyo").normalize(), periods=days):
+        sessions.append(pd.date_range(day + pd.Timedelta(hours=9), periods=30, freq="5min"))
+        sessions.append(pd.date_range(day + pd.Timedelta(hours=12, minutes=30), periods=36, freq="5min"))
+    index = sessions[0].append(sessions[1:])
+    n = len(index)
+
+    frames = {}
+    for i in range(n_symbols):
+        close = np.round(1000 + np.cumsum(rng.normal(0, 4, n)), 1)
+        spread = np.round(rng.uniform(0, 3, (2, n)), 1)
+        frames[f"{1000 + i}.T"] = pd.DataFrame({
+            "Open": np.round(close + rng.normal(0, 1, n), 1),
+            "High": close + spread[0],
+            "Low": close - spread[1],
+            "Close": close,
+            "Volume": rng.integers(1_000, 100_000, n).astype(np.int64),
+        }, index=index)
+    return frames
+
+
+# yfinance の代わりに合成データを返す取得元（記録ファイルを作るために使う）
+class SyntheticProvider:
+    def __init__(self, frames):
+        self.frames = frames
+
+    def download(self, tickers, period="5d", interval="5m", start=None):
+        out = {}
+        for sym in tickers:
+            df = self.frames.get(sym)
+            if df is not None:
+                out[sym] = df if start is None else df[df.index >= start]
+        return out
+
+    def info(self, symbol):
+        return {"name": f"銘柄{symbol}", "market": "jp_market", "sector": None}
+
+
+def record_synthetic(frames, path):
+    if os.path.exists(path):
+        os.remove(path)
+    recorder = RecordingProvider(SyntheticProvider(frames), path)
+    recorder.download(list(frames))
+    for sym in frames:
+        recorder.info(sym[:-2])
+    recorder.recording.close()
+
+
+def populate_users(n_users, subs, symbols, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = [s[:-2] for s in symbols]
+    Subscription.query.delete()
+    User.query.delete()
+    users, rows = [], []
+    for uid in range(1, n_users + 1):
+        picks = rng.choice(len(codes), size=min(subs, len(codes)), replace=False)
+        chosen = [codes[i] for i in picks]
+        users.append({"id": uid, "username": f"bench{uid}", "password_hash": "x", "role": "user",
+                      "email": f"bench{uid}@example.com", "symbols": "\n".join(chosen), "notify_enabled": True})
+        rows.extend({"user_id": uid, "symbol": code} for code in chosen)
+    db.session.execute(User.__table__.insert(), users)
+    db.session.execute(Subscription.__table__.insert(), rows)
+    db.session.commit()
+
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time_module.perf_counter()
+        yield
+        self.stages[name] = self.stages.get(name, 0.0) + time_module.perf_counter() - started
+
+
+# シャード分担モードの1ワーカー（fork した子プロセスで run_strategy を実行し、送信宛先数を返す）
+def _sharded_worker(strategy_name, slot, _):
+    backend = FakeBackend()
+    run_bot.Dispatcher = partial(Dispatcher, backend=backend)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_bot.run_strategy(strategy_name, slot=slot)
+    return sum(len(recipients) for recipients, _, _ in backend.sent)
+
+
+def bench_scale(n_symbols, n_users, subs, strategy_name, trace_memory=False, shard_workers=0,
+                latency=0.0, jitter=0.0, error_rate=0.0):
+    frames = synthetic_bars(n_symbols)
+    recording_path = os.path.join(WORKDIR, "market_data.db")
+    record_synthetic(frames, recording_path)
+    del frames
+    # 取得元は記録の再生（遅延・エラー率を指定して本番相当の負荷を再現）
+    make_provider = partial(ReplayProvider, recording_path, latency=latency, jitter=jitter,
+                            error_rate=error_rate, seed=0)
+    provider = make_provider()
+    make_fetcher = partial(BatchFetcher, sleep=lambda s: None, rate_limiter=AdaptiveRateLimiter(initial_interval=0.0))
+    for path in (os.environ["BAR_CACHE_PATH"],):
+        if os.path.exists(path):
+            os.remove(path)
+
+    timer = Timer()
+    if trace_memory:
+        tracemalloc.start()
+    started = time_module.perf_counter()
+    with run_bot.app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+        db.create_all()
+        with timer.stage("db_populate"):
+            populate_users(n_users, subs, [f"{1000 + i}.T" for i in range(n_symbols)])
+        with timer.stage("db_index"):
+            symbol_index = build_symbol_index(db.session)
+
+        tickers = sorted(s + ".T" for s in symbol_index)
+        bar_cache = BarCache(os.environ["BAR_CACHE_PATH"])
+        with timer.stage("fetch_cold"):
+            cache, _ = fetch_incremental(make_fetcher(transport=provider.download), bar_cache, tickers)
+        with timer.stage("fetch"):
+            cache, _ = fetch_incremental(make_fetcher(transport=provider.download), bar_cache, tickers)
+        bar_cache.close()
+
+        engine = IndicatorEngine()
+        views = {sym[:-2]: engine.for_symbol(sym[:-2], df) for sym, df in cache.items()}
+        with timer.stage("indicator"):
+            for ind in views.values():
+                ind.rsi(14), ind.stoch(14, 3), ind.macd(), ind.atr(14)
+                ind.sma(5), ind.sma(10), ind.volume_avg(10), ind.volume_avg(20), ind.prior_high(10)
+
+        detectors, signals = {}, {}
+        with timer.stage("detect"):
+            for name, detector in DETECTORS.items():
+                t0 = time_module.perf_counter()
+                hits = {sym: detector(ind.df, ind) for sym, ind in views.items()}
+                detectors[name] = time_module.perf_counter() - t0
+                if name == strategy_name:
+                    signals = {sym: sig for sym, sig in hits.items() if sig}
+
+        with timer.stage("vectorized"):
+            frames_by_code = {sym[:-2]: df for sym, df in cache.items()}
+            ShardedEvaluator(workers=1).evaluate_many(frames_by_code, {strategy_name: run_bot.STRATEGIES[strategy_name]})
+
+        backend = FakeBackend()
+        with timer.stage("notify"):
+            directory = SymbolDirectory(db.session, lookup=provider.info)
+            directory.preload(symbol_index)
+            dispatcher = Dispatcher(backend=backend)
+            for _, (user, results) in fan_out(symbol_index, signals).items():
+                run_bot.notify_user(user, results, strategy_name, directory, dispatcher)
+            dispatch_stats = dispatcher.flush()
+        with timer.stage("directory_refresh"):
+            directory.refresh()
+
+        # run_strategy を外部 I/O なしで通し実行
+        originals = (run_bot.BatchFetcher, run_bot.Dispatcher, run_bot.market_data_provider)
+        run_bot.BatchFetcher = make_fetcher
+        e2e_backend = FakeBackend()
+        run_bot.Dispatcher = partial(Dispatcher, backend=e2e_backend)
+        run_bot.market_data_provider = make_provider
+        try:
+            with timer.stage("end_to_end"):
+                run_bot.run_strategy(strategy_name)
+            e2e_emails = sum(len(recipients) for recipients, _, _ in e2e_backend.sent)
+            # 同じ戦略の次の実行枠（抑止期間内なので同じ通知は送られない）
+            with timer.stage("end_to_end_repeat"):
+                run_bot.run_strategy(strategy_name)
+            repeat_emails = sum(len(recipients) for recipients, _, _ in e2e_backend.sent) - e2e_emails
+            db.session.query(SentNotification).delete()
+            db.session.commit()
+
+            # 同じ DB を共有する複数プロセスでシャード分担（通知は集約役の1プロセスだけ）
+            sharded_emails = None
+            if shard_workers > 1 and run_bot.PIPELINE_MODE != "async":  # async はシャード分担に対応しない
+                shard_count = run_bot.SHARD_COUNT
+                run_bot.SHARD_COUNT = shard_workers * 2
+                slot = f"bench-{n_symbols}-{n_users}"
+                try:
+                    with timer.stage("sharded"), multiprocessing.get_context("fork").Pool(shard_workers) as pool:
+                        sharded_emails = sum(pool.map(partial(_sharded_worker, strategy_name, slot),
+                                                      range(shard_workers)))
+                finally:
+                    run_bot.SHARD_COUNT = shard_count
+
+            # 全戦略を1回の取得・指標計算でまとめて評価（単独実行との差が検出関数ぶんだけになるか）
+            db.session.query(SentNotification).delete()
+            db.session.commit()
+            sent_before = sum(len(recipients) for recipients, _, _ in e2e_backend.sent)
+            with timer.stage("end_to_end_all_strategies"):
+                run_bot.run_strategies(list(run_bot.STRATEGIES))
+            all_emails = sum(len(recipients) for recipients, _, _ in e2e_backend.sent) - sent_before
+        finally:
+            run_bot.BatchFetcher, run_bot.Dispatcher, run_bot.market_data_provider = originals
+
+    wall = time_module.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return {
+        "symbols": n_symbols,
+        "users": n_users,
+        "subscriptions_per_user": subs,
+        "strategy": strategy_name,
+        "wall_seconds": wall,
+        "stages": timer.stages,
+        "detectors": detectors,
+        "signals": len(signals),
+        "emails": dispatch_stats.sent,
+        "email_api_calls": dispatch_stats.api_calls,
+        "end_to_end_emails": e2e_emails,
+        "repeat_emails": repeat_emails,
+        "sharded_emails": sharded_emails,
+        "all_strategies_emails": all_emails,
+        "replay": {"latency": latency, "jitter": jitter, "error_rate": error_rate, "requests": provider.requests},
+        "peak_traced_mb": peak,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+# 規模ごとに新しいプロセスで計測する（max_rss_mb はプロセス全体の最大値なので、同じプロセスだと前の規模の値が残る）
+# 子プロセス内でシャード分担の Pool を作るため、デーモンではない Process を使う
+def _bench_child(sender, args):
+    sender.send(bench_scale(*args))
+    sender.close()
+
+
+def bench_scale_isolated(*args):
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_bench_child, args=(sender, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f"ベンチマークのプロセスが異常終了しました（終了コード {process.exitcode}）")
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run_bot の合成データベンチマーク")
+    parser.add_argument("--symbols", default="100,1000,5000")
+    parser.add_argument("--users", default="100,10000")
+    parser.add_argument("--subs", type=int, default=10)
+    parser.add_argument("--strategy", default="リバーサル・シーカー")
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0, help="再生時の1リクエストあたりの遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--shard-workers", type=int, default=0, help="シャード分担モードを N プロセスで通し実行")
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n_symbols in map(int, args.symbols.split(",")):
+        for n_users in map(int, args.users.split(",")):
+            print(f"⏱ symbols={n_symbols} users={n_users}", file=sys.stderr, flush=True)
+            results.append(bench_scale_isolated(n_symbols, n_users, args.subs, args.strategy,
+                                                args.trace_memory, args.shard_workers,
+                                                args.latency, args.jitter, args.error_rate))
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import os
+import socket
+import threading
+import time as time_module
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from models import BotRun, ShardLease, ShardResult
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS", "120"))
+SHARD_POLL_SECONDS = float(os.getenv("SHARD_POLL_SECONDS", "2"))
+SHARD_WAIT_SECONDS = int(os.getenv("SHARD_WAIT_SECONDS", "600"))
+SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+# 🤝 DB 上の実行・リース表で銘柄シャードを複数ワーカーに割り振る
+# 取得・完了・集約役の決定はすべて条件付き UPDATE の更新件数で判定する（SQLite / PostgreSQL 共通）
+class ShardCoordinator:
+    def __init__(self, session, worker_id=None, lease_seconds=SHARD_LEASE_SECONDS, clock=datetime.utcnow,
+                 max_attempts=SHARD_MAX_ATTEMPTS):
+        self.session = session
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.max_attempts = max_attempts
+
+    # 同じ (戦略, 実行枠) の実行がなければ作る。先を越されたら既存の実行に合流する
+    def ensure_run(self, strategy, slot, symbols, shard_count=SHARD_COUNT):
+        run = self.session.query(BotRun).filter_by(strategy=strategy, slot=slot).one_or_none()
+        if run is not None:
+            return run
+        symbols = sorted(symbols)
+        shard_count = max(1, min(shard_count, len(symbols)))
+        run = BotRun(strategy=strategy, slot=slot, status="running", shard_count=shard_count,
+                     created_at=self.clock())
+        self.session.add(run)
+        try:
+            self.session.flush()
+            self.session.add_all([
+                ShardLease(run_id=run.id, shard=i, symbols="\n".join(symbols[i::shard_count]),
+                           status="pending", attempts=0)
+                for i in range(shard_count)
+            ])
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            run = self.session.query(BotRun).filter_by(strategy=strategy, slot=slot).one()
+        return run
+
+    def _expired(self, now):
+        return and_(ShardLease.status == "leased", ShardLease.lease_expires_at < now)
+
+    def _claimable(self, now):
+        return or_(ShardLease.status == "pending",
+                   and_(self._expired(now), ShardLease.attempts < self.max_attempts))
+
+    # 取り直しの上限に達したシャード（毎回ワーカーを落とすなど）は失敗扱いにして、残りだけで集約できるようにする
+    def fail_exhausted(self, run, now):
+        result = self.session.execute(
+            update(ShardLease)
+            .where(ShardLease.run_id == run.id, self._expired(now), ShardLease.attempts >= self.max_attempts)
+            .values(status="failed", finished_at=now)
+        )
+        self.session.commit()
+        if result.rowcount:
+            print(f"⚠️ {result.rowcount}件のシャードが{self.max_attempts}回失敗したため打ち切りました", flush=True)
+        return result.rowcount
+
+    def claim(self, run):
+        now = self.clock()
+        self.fail_exhausted(run, now)
+        shards = [s for (s,) in self.session.query(ShardLease.shard)
+                  .filter(ShardLease.run_id == run.id, self._claimable(now))
+                  .order_by(ShardLease.shard)]
+        self.session.commit()
+        # ワーカーごとに開始位置をずらして取り合いを減らす
+        offset = hash(self.worker_id) % len(shards) if shards else 0
+        for shard in shards[offset:] + shards[:offset]:
+            result = self.session.execute(
+                update(ShardLease)
+                .where(ShardLease.run_id == run.id, ShardLease.shard == shard, self._claimable(now))
+                .values(status="leased", owner=self.worker_id, attempts=ShardLease.attempts + 1,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+            )
+            self.session.commit()
+            if result.rowcount == 1:
+                return self.session.get(ShardLease, (run.id, shard))
+        return None
+
+    def _owned(self, run_id, shard):
+        return and_(ShardLease.run_id == run_id, ShardLease.shard == shard,
+                    ShardLease.owner == self.worker_id, ShardLease.status == "leased")
+
+    # session を渡すと別スレッド（LeaseKeeper）から使える
+    def renew(self, run_id, shard, session=None):
+        session = session or self.session
+        result = session.execute(
+            update(ShardLease).where(self._owned(run_id, shard))
+            .values(lease_expires_at=self.clock() + timedelta(seconds=self.lease_seconds))
+        )
+        session.commit()
+        return result.rowcount == 1
+
+    # リースを保持している場合だけ結果を書き込んで完了にする（取り直された後の結果は捨てる）
+    def complete(self, lease, signals):
+        run_id, shard = lease.run_id, lease.shard
+        result = self.session.execute(
+            update(ShardLease).where(self._owned(run_id, shard)).values(status="done", finished_at=self.clock())
+        )
+        if result.rowcount != 1:
+            self.session.rollback()
+            return False
+        self.session.query(ShardResult).filter_by(run_id=run_id, shard=shard).delete()
+        self.session.add_all([
+            ShardResult(run_id=run_id, shard=shard, symbol=symbol, signal=signal)
+            for symbol, signal in sorted(signals.items())
+        ])
+        self.session.commit()
+        return True
+
+    def remaining(self, run):
+        count = (self.session.query(ShardLease)
+                 .filter(ShardLease.run_id == run.id, ShardLease.status.notin_(("done", "failed"))).count())
+        self.session.commit()
+        return count
+
+    def failed(self, run):
+        count = self.session.query(ShardLease).filter_by(run_id=run.id, status="failed").count()
+        self.session.commit()
+        return count
+
+    def status(self, run):
+        status = self.session.query(BotRun.status).filter(BotRun.id == run.id).scalar()
+        self.session.commit()
+        return status
+
+    # 全シャード完了後、最初に running → notifying へ切り替えたワーカーだけが集約役になる
+    def try_aggregate(self, run):
+        if self.remaining(run):
+            return False
+        self.fail_exhausted(run, self.clock())
+        result = self.session.execute(
+            update(BotRun).where(BotRun.id == run.id, BotRun.status == "running")
+            .values(status="notifying", aggregator=self.worker_id)
+        )
+        self.session.commit()
+        return result.rowcount == 1
+
+    def results(self, run):
+        rows = self.session.query(ShardResult).filter_by(run_id=run.id).order_by(ShardResult.symbol).all()
+        return {row.symbol: row.signal for row in rows}
+
+    def finish(self, run, status="done"):
+        self.session.execute(
+            update(BotRun).where(BotRun.id == run.id).values(status=status, finished_at=self.clock())
+        )
+        self.session.commit()
+
+
+# 💓 処理中のリースを別スレッド・別セッションで定期的に延長する（延長できなければ lost を立てる）
+class LeaseKeeper:
+    def __init__(self, coordinator, run_id, shard, interval=None):
+        self.coordinator = coordinator
+        self.run_id = run_id
+        self.shard = shard
+        self.interval = interval if interval is not None else coordinator.lease_seconds / 3
+        # scoped_session はスレッドごとなので、エンジンだけ呼び出し元で取り出して別セッションを作る
+        self._session_factory = sessionmaker(bind=coordinator.session.get_bind())
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        session = self._session_factory()
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    renewed = self.coordinator.renew(self.run_id, self.shard, session=session)
+                except Exception as e:
+                    # 一時的な DB エラーは次の周期で再試行（期限までに延長できなければ取り直される）
+                    session.rollback()
+                    print(f"⚠️ リース延長エラー(シャード{self.shard}): {e}", flush=True)
+                    continue
+                if not renewed:
+                    self.lost.set()
+                    return
+        finally:
+            session.close()
+
+    # 評価関数から区切りごとに呼ぶ。リースを失っていたら以降の処理を打ち切る
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"シャード{self.shard}のリースを失いました")
+
+
+# 🧩 シャードを取れるだけ処理し、最後に全体が揃っていれば集約して通知する
+# evaluate(symbols, heartbeat) -> {銘柄: シグナル}、aggregate({銘柄: シグナル}) は呼び出し側が用意する
+# heartbeat() はリースを失っていれば LeaseLost を投げる（延長自体は LeaseKeeper が定期的に行う）
+def run_shards(coordinator, run, evaluate, aggregate, poll_seconds=SHARD_POLL_SECONDS,
+               wait_seconds=SHARD_WAIT_SECONDS, sleep=time_module.sleep):
+    deadline = time_module.monotonic() + wait_seconds
+    processed = 0
+    while True:
+        lease = coordinator.claim(run)
+        if lease is not None:
+            symbols = [s for s in lease.symbols.split("\n") if s]
+            keeper = LeaseKeeper(coordinator, lease.run_id, lease.shard).start()
+            try:
+                signals = evaluate(symbols, keeper.check)
+            except LeaseLost as e:
+                print(f"⚠️ {e}。処理を打ち切ります", flush=True)
+                continue
+            finally:
+                keeper.stop()
+            if coordinator.complete(lease, signals):
+                processed += 1
+                print(f"🧩 シャード{lease.shard}完了: {len(symbols)}銘柄 / {len(signals)}件シグナル", flush=True)
+            else:
+                print(f"⚠️ シャード{lease.shard}のリースが失効したため結果を破棄しました", flush=True)
+            continue
+
+        if coordinator.try_aggregate(run):
+            failed = coordinator.failed(run)
+            if failed:
+                print(f"⚠️ 失敗した{failed}件のシャードを除いて集約します", flush=True)
+            try:
+                aggregate(coordinator.results(run))
+            finally:
+                coordinator.finish(run)
+            return processed, True
+        if coordinator.status(run) != "running" or time_module.monotonic() > deadline:
+            return processed, False
+        sleep(poll_seconds)
@@ -0,0 +1,156 @@
+import os
+import time as time_module
+from datetime import datetime, timedelta
+
+import holidays
+
+from run_bot import (app, TIME_STRATEGY_MAP, STRATEGIES, notify_user, FETCH_BATCH_SIZE, FETCH_WORKERS,
+                     FETCH_MAX_RETRIES, BAR_CACHE_PATH, BAR_RETENTION_DAYS)
+from models import db
+from fetcher import BatchFetcher
+from market_data import market_data_provider
+from bar_cache import BarCache, fetch_incremental
+from streaming import SymbolState
+from subscriptions import backfill_subscriptions, build_symbol_index, build_strategy_index, fan_out, wants_strategy
+from symbol_directory import SymbolDirectory
+from notifier import Dispatcher
+from ledger import NotificationLedger
+from instrumentation import metrics, save_run_summary
+from snapshots import snapshot_from_states, save_snapshot
+
+PREFETCH_LEAD_SECONDS = int(os.getenv("PREFETCH_LEAD_SECONDS", "60"))
+
+
+def now_jst():
+    return datetime.utcnow() + timedelta(hours=9)
+
+
+# 🕰 常駐して戦略時刻ちょうどに実行するスケジューラ
+class StrategyDaemon:
+    def __init__(self, fetcher=None, provider=None, clock=now_jst, sleep=time_module.sleep):
+        self.provider = provider or market_data_provider()
+        self.fetcher = fetcher or BatchFetcher(transport=self.provider.download, batch_size=FETCH_BATCH_SIZE,
+                                               max_workers=FETCH_WORKERS, max_retries=FETCH_MAX_RETRIES,
+                                               per_symbol_calls=getattr(self.provider, "per_symbol_calls", False))
+        self.clock = clock
+        self.sleep = sleep
+        self.holidays = holidays.Japan()
+        self.slots = sorted(TIME_STRATEGY_MAP.items())
+        self.states = {}
+        self.pending = {}
+        self.symbol_index = {}
+        self.strategy_index = {}
+        self.directory = None
+
+    def is_trading_day(self, day):
+        return day.weekday() < 5 and day not in self.holidays
+
+    # 次に実行する (時刻, 戦略名)
+    def next_slot(self, now):
+        day = now.date()
+        while True:
+            if self.is_trading_day(day):
+                for hhmm, strategy_name in self.slots:
+                    at = datetime.combine(day, datetime.strptime(hhmm, "%H:%M").time())
+                    if at > now:
+                        return at, strategy_name
+            day += timedelta(days=1)
+            now = datetime.combine(day, datetime.min.time()) - timedelta(microseconds=1)
+
+    def sleep_until(self, at):
+        delay = (at - self.clock()).total_seconds()
+        if delay > 0:
+            self.sleep(delay)
+
+    # 新しい足だけをストリーミング状態に反映（最新の未確定足は保留して評価時に試し更新）
+    def refresh(self):
+        with app.app_context():
+            session = db.session
+            backfill_subscriptions(session)
+            self.symbol_index = build_symbol_index(session)
+            self.strategy_index = build_strategy_index(session)
+            self.directory = SymbolDirectory(session, lookup=self.provider.info)
+            self.directory.preload(self.symbol_index)
+            session.expunge_all()
+
+        symbols = sorted(s + ".T" for s in self.symbol_index)
+        bar_cache = BarCache(BAR_CACHE_PATH)
+        cache, failed = fetch_incremental(self.fetcher, bar_cache, symbols, interval="5m", period="5d")
+        bar_cache.evict(BAR_RETENTION_DAYS)
+        bar_cache.close()
+
+        fed = 0
+        for sym, bars in cache.items():
+            state = self.states.setdefault(sym, SymbolState())
+            rows = bars.rows(after=state.last_ts)
+            for ts, o, h, l, c, v in rows[:-1]:
+                state.update(ts, o, h, l, c, v)
+                fed += 1
+            if rows:
+                self.pending[sym] = rows[-1]
+        for sym in set(self.states) - set(symbols):
+            del self.states[sym]
+            self.pending.pop(sym, None)
+        print(f"📡 状態更新: {len(cache)}銘柄 / 新規足 {fed}本（取得失敗{len(failed)}件）", flush=True)
+
+    def run_slot(self, strategy_name):
+        print(f"🚀 現在の戦略: {strategy_name}", flush=True)
+        metrics.reset()
+        with metrics.timer("fetch"):
+            self.refresh()
+        strategy = STRATEGIES[strategy_name]
+        signals, evaluated = {}, {}
+        for sym in self.symbol_index:
+            state = self.states.get(sym + ".T")
+            if state is None:
+                print(f"⚠️ {sym} のデータが取得できませんでした", flush=True)
+                continue
+            pending = self.pending.get(sym + ".T")
+            if pending is not None:
+                state = state.peek(*pending)
+            signal = strategy.evaluate_state(state)
+            evaluated[sym] = state
+            metrics.incr("symbols_processed")
+            if signal:
+                signals[sym] = signal
+
+        dispatcher = Dispatcher()
+        with app.app_context():
+            with metrics.timer("notify"):
+                ledger = NotificationLedger(db.session, strategy_name).load()
+                self.directory.ensure(signals)
+                for uid, (user, results) in fan_out(self.symbol_index, signals).items():
+                    if not wants_strategy(self.strategy_index, uid, strategy_name):
+                        continue
+                    notify_user(user, results, strategy_name, self.directory, dispatcher, ledger)
+                dispatcher.flush()
+                ledger.save(dispatcher.stats.failed_recipients)
+                ledger.evict()
+            with metrics.timer("db.directory_refresh"):
+                self.directory.refresh()
+            with metrics.timer("snapshot"):
+                snapshot = snapshot_from_states(evaluated)
+            summary = save_run_summary(db.session, strategy_name)
+            save_snapshot(db.session, summary.id, strategy_name, snapshot, signals)
+
+    def run_forever(self):
+        print(f"🕰 デーモン起動（戦略 {len(self.slots)}枠, 先読み {PREFETCH_LEAD_SECONDS}秒前）", flush=True)
+        with app.app_context():
+            db.create_all()
+        while True:
+            at, strategy_name = self.next_slot(self.clock())
+            print(f"⏳ 次回 {at.strftime('%m/%d %H:%M')} {strategy_name}", flush=True)
+            self.sleep_until(at - timedelta(seconds=PREFETCH_LEAD_SECONDS))
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ 先読みエラー: {e}", flush=True)
+            self.sleep_until(at)
+            try:
+                self.run_slot(strategy_name)
+            except Exception as e:
+                print(f"❌ 戦略実行エラー({strategy_name}): {e}", flush=True)
+
+
+if __name__ == "__main__":
+    StrategyDaemon().run_forever()
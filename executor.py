@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from vectorized import BarPanel, evaluate_panel_many
+
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "1"))
+EVAL_CHUNK_SIZE = int(os.getenv("EVAL_CHUNK_SIZE", "256"))
+
+
+# ワーカー側：共有メモリ上のパネルから担当行だけをビューとして取り出して評価
+def _evaluate_shard(task):
+    shm_name, shape, start, stop, symbols, lengths, strategies = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        panel = BarPanel.from_array(symbols, data[:, start:stop], lengths)
+        signals = evaluate_panel_many(panel, strategies)
+        del data, panel
+        return start, signals
+    finally:
+        shm.close()
+
+
+# ⚙️ 銘柄をシャードに分けてプロセスプールで評価（workers<=1 ならプロセス内で実行）
+class ShardedEvaluator:
+    def __init__(self, workers=EVAL_WORKERS, chunk_size=EVAL_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    # パネルは1回だけ組み、期限の来た戦略をまとめて評価する（strategies は {戦略名: Strategy}。結果は {戦略: {銘柄: 通知文言}}）
+    def evaluate_many(self, frames, strategies):
+        symbols, shape = BarPanel.shape_of(frames)
+        if self.workers <= 1 or len(symbols) <= self.chunk_size:
+            return evaluate_panel_many(BarPanel.from_frames(frames), strategies)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            panel = BarPanel.from_frames(frames, data=data)
+            tasks = [
+                (shm.name, shape, start, min(start + self.chunk_size, len(symbols)),
+                 panel.symbols[start:start + self.chunk_size], panel.lengths[start:start + self.chunk_size],
+                 strategies)
+                for start in range(0, len(symbols), self.chunk_size)
+            ]
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                shards = list(pool.map(_evaluate_shard, tasks))
+            del data, panel
+        finally:
+            shm.close()
+            shm.unlink()
+
+        # シャード順 → 銘柄順で結合して結果を決定的にする
+        signals = {name: {} for name in strategies}
+        for _, shard in sorted(shards, key=lambda item: item[0]):
+            for name, hits in shard.items():
+                signals[name].update(hits)
+        return {name: dict(sorted(hits.items())) for name, hits in signals.items()}
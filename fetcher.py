@@ -0,0 +1,154 @@
+import random
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from instrumentation import metrics, log, DEBUG
+
+
+# 🌐 yfinance を使った標準トランスポート（複数銘柄を1回の呼び出しで取得）
+# threads=False なので実際の HTTP は銘柄ごとに1回ずつ順番に行われる（バッチはまとめ方にすぎない）
+# また yf.download は銘柄ごとの例外（429 を含む）をログに出すだけで、その銘柄を空のまま返す
+def yfinance_transport(tickers, period="5d", interval="5m", start=None):
+    import yfinance as yf
+
+    kwargs = {"interval": interval, "group_by": "ticker", "progress": False, "threads": False}
+    if start is not None:
+        kwargs["start"] = start
+    else:
+        kwargs["period"] = period
+    raw = yf.download(tickers, **kwargs)
+
+    frames = {}
+    if raw is None or raw.empty:
+        return frames
+    for sym in tickers:
+        if isinstance(raw.columns, pd.MultiIndex):
+            if sym not in raw.columns.get_level_values(0):
+                continue
+            df = raw[sym]
+        else:
+            df = raw
+        df = df.dropna(how="all")
+        if not df.empty:
+            frames[sym] = df
+    return frames
+
+
+def is_rate_limit_error(exc):
+    text = f"{type(exc).__name__} {exc}"
+    return "429" in text or "RateLimit" in text or "Too Many Requests" in text
+
+
+# ⏱ エラー/429 に応じてリクエスト間隔を伸縮させるレートリミッタ
+class AdaptiveRateLimiter:
+    def __init__(self, min_interval=0.0, max_interval=30.0, initial_interval=0.2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = initial_interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    # calls は今回の呼び出しで実際に行う HTTP の回数（その分だけ次の枠を先に送る）
+    def wait(self, calls=1):
+        with self._lock:
+            now = time_module.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval * calls
+        if slot > now:
+            time_module.sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.interval = max(self.min_interval, self.interval * 0.8)
+
+    def on_error(self, rate_limited=False):
+        with self._lock:
+            factor = 2.0 if rate_limited else 1.5
+            self.interval = min(self.max_interval, max(self.interval, 0.1) * factor)
+
+
+@dataclass
+class FetchResult:
+    data: dict = field(default_factory=dict)
+    failed: list = field(default_factory=list)
+    requests: int = 0
+    rate_limited: int = 0
+
+
+# 📥 複数銘柄まとめ取得 + 並列数制限 + 銘柄単位リトライ
+# per_symbol_calls=True は、取得元が1バッチを銘柄ごとの HTTP に分けて送る場合（yfinance）。レート制限を銘柄数ぶん消費する
+class BatchFetcher:
+    def __init__(self, transport=yfinance_transport, batch_size=50, max_workers=4,
+                 max_retries=3, backoff_base=1.0, rate_limiter=None, sleep=time_module.sleep,
+                 per_symbol_calls=False):
+        self.transport = transport
+        self.per_symbol_calls = per_symbol_calls
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self._sleep = sleep
+
+    def fetch(self, symbols, **transport_kwargs):
+        result = FetchResult()
+        attempts = {sym: 0 for sym in symbols}
+        pending = list(dict.fromkeys(symbols))
+        retry_round = 0
+
+        while pending:
+            chunks = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                outcomes = list(executor.map(lambda c: self._fetch_chunk(c, transport_kwargs), chunks))
+
+            retry = []
+            for chunk, (frames, rate_limited) in zip(chunks, outcomes):
+                result.requests += 1
+                result.rate_limited += int(rate_limited)
+                for sym in chunk:
+                    df = frames.get(sym)
+                    if df is not None and not df.empty:
+                        result.data[sym] = df
+                        continue
+                    # 応答に含まれない銘柄は、コード誤りか一時的な失敗（yfinance は 429 も空で返す）か区別できないので再試行する
+                    attempts[sym] += 1
+                    if attempts[sym] > self.max_retries:
+                        result.failed.append(sym)
+                    else:
+                        retry.append(sym)
+
+            pending = retry
+            if pending:
+                delay = self.backoff_base * (2 ** retry_round) * (1 + random.random() * 0.25)
+                print(f"🔁 {len(pending)}件を再取得（{delay:.1f}秒待機）", flush=True)
+                self._sleep(delay)
+                retry_round += 1
+
+        if result.failed:
+            print(f"❌ 取得失敗 {len(result.failed)}件: {', '.join(result.failed)}", flush=True)
+        return result
+
+    # (銘柄→足, 429 だったか)
+    def _fetch_chunk(self, chunk, transport_kwargs):
+        self.rate_limiter.wait(len(chunk) if self.per_symbol_calls else 1)
+        try:
+            log(DEBUG, "📥 Downloading: %d銘柄 (%s ...)", len(chunk), chunk[0])
+            with metrics.timer("fetch.request"):
+                frames = self.transport(chunk, **transport_kwargs) or {}
+        except Exception as e:
+            metrics.incr("fetch.errors")
+            rate_limited = is_rate_limit_error(e)
+            self.rate_limiter.on_error(rate_limited=rate_limited)
+            print(f"❌ エラー({chunk[0]} ほか{len(chunk) - 1}件): {e}", flush=True)
+            return {}, rate_limited
+        # バッチ全体が空なら制限されている可能性が高いので間隔を伸ばす
+        if frames:
+            self.rate_limiter.on_success()
+        else:
+            metrics.incr("fetch.empty")
+            self.rate_limiter.on_error()
+        return frames, False
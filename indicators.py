@@ -0,0 +1,97 @@
+import os
+
+import pandas_ta as ta
+
+from instrumentation import metrics
+
+# EWM 系（RSI・ATR・MACD）は初期値の影響を薄めるため、期間の何倍ぶん余分に足を持つか
+INDICATOR_WARMUP = float(os.getenv("INDICATOR_WARMUP", "3"))
+
+
+# 📏 指標が最新足で値を持つのに必要な本数（EWM 系は助走ぶんを上乗せ）
+def required_bars(name, params, warmup=None):
+    warmup = INDICATOR_WARMUP if warmup is None else warmup
+    if name in ("rsi", "atr"):
+        length, = params
+        return length + 1 + int(warmup * length)
+    if name == "macd":
+        fast, slow, signal = params
+        return slow + signal - 1 + int(warmup * slow)
+    if name == "stoch":
+        k, d = params
+        return k + 2 + d - 1
+    if name == "prior_high":
+        length, = params
+        return length + 1
+    length, = params
+    return length
+
+
+# 🧮 1回の実行内で (銘柄, 最終足, 指標, パラメータ) ごとに1度だけ計算する指標キャッシュ
+class IndicatorEngine:
+    def __init__(self):
+        self._memo = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol, df, name, params, compute):
+        last_ts = df.index[-1] if len(df) else None
+        key = (symbol, last_ts, len(df), name, params)
+        if key in self._memo:
+            self.hits += 1
+            return self._memo[key]
+        self.misses += 1
+        with metrics.timer(f"indicator.{name}"):
+            value = compute()
+        self._memo[key] = value
+        return value
+
+    def for_symbol(self, symbol, df):
+        return SymbolIndicators(self, symbol, df)
+
+    def clear(self):
+        self._memo.clear()
+
+
+# 銘柄ごとのビュー（検出関数はこれ経由で指標を読む。戻り値は共有されるので書き換え禁止）
+class SymbolIndicators:
+    __slots__ = ("engine", "symbol", "df")
+
+    def __init__(self, engine, symbol, df):
+        self.engine = engine
+        self.symbol = symbol
+        self.df = df
+
+    @classmethod
+    def standalone(cls, df):
+        return cls(IndicatorEngine(), None, df)
+
+    def _get(self, name, params, compute):
+        return self.engine.get(self.symbol, self.df, name, params, compute)
+
+    # 宣言された (指標名, パラメータ) をまとめて先に計算しておく
+    def prepare(self, requirements):
+        for name, params in requirements:
+            getattr(self, name)(*params)
+
+    def rsi(self, length=14):
+        return self._get("rsi", (length,), lambda: ta.rsi(self.df["Close"], length=length))
+
+    def stoch(self, k=14, d=3):
+        return self._get("stoch", (k, d), lambda: ta.stoch(self.df["High"], self.df["Low"], self.df["Close"], k=k, d=d))
+
+    def macd(self, fast=12, slow=26, signal=9):
+        return self._get("macd", (fast, slow, signal), lambda: ta.macd(self.df["Close"], fast=fast, slow=slow, signal=signal))
+
+    def atr(self, length=14):
+        return self._get("atr", (length,), lambda: ta.atr(self.df["High"], self.df["Low"], self.df["Close"], length=length))
+
+    def sma(self, length):
+        return self._get("sma", (length,), lambda: self.df["Close"].rolling(length).mean())
+
+    def volume_avg(self, length):
+        return self._get("volume_avg", (length,), lambda: self.df["Volume"].rolling(length).mean())
+
+    # 直前 length 本の高値の最大値（当該足は含まない）
+    def prior_high(self, length):
+        return self._get("prior_high", (length,), lambda: self.df["High"].shift(1).rolling(length).max())
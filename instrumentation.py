@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time as time_module
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+_LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+LOG_LEVEL = _LEVELS.get(os.getenv("LOG_LEVEL", "INFO").upper(), INFO)
+
+
+def log_enabled(level):
+    return level >= LOG_LEVEL
+
+
+# 📝 レベル判定を先に行い、無効なときは文字列整形そのものを省く
+def log(level, fmt, *args):
+    if level < LOG_LEVEL:
+        return
+    print(fmt % args if args else fmt, flush=True)
+
+
+# ⏱ 実行ごとのタイマー・カウンタ（スレッドから同時に記録されても安全）
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.utcnow()
+            self.timings = {}
+            self.calls = {}
+            self.counters = {}
+
+    @contextmanager
+    def timer(self, name):
+        started = time_module.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time_module.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {"timings": dict(self.timings), "calls": dict(self.calls), "counters": dict(self.counters)}
+
+
+metrics = Metrics()
+
+
+# 💾 実行サマリーを DB に保存
+def save_run_summary(session, strategy_name, status="ok"):
+    from models import RunSummary
+
+    snap = metrics.snapshot()
+    summary = RunSummary(
+        strategy=strategy_name,
+        started_at=metrics.started_at,
+        finished_at=datetime.utcnow(),
+        status=status,
+        symbols_processed=snap["counters"].get("symbols_processed", 0),
+        fetch_failures=snap["counters"].get("fetch_failures", 0),
+        emails_sent=snap["counters"].get("emails_sent", 0),
+        emails_failed=snap["counters"].get("emails_failed", 0),
+        stage_seconds=json.dumps(snap["timings"], ensure_ascii=False),
+        stage_calls=json.dumps(snap["calls"], ensure_ascii=False),
+    )
+    session.add(summary)
+    session.commit()
+    return summary
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 📈 最新の実行サマリーを Prometheus のテキスト形式に変換
+def render_prometheus(summary):
+    if summary is None:
+        return "# 実行履歴なし\n"
+    strategy = _label(summary.strategy)
+    lines = [
+        "# HELP cross_notifier_last_run_timestamp_seconds 直近の実行終了時刻",
+        "# TYPE cross_notifier_last_run_timestamp_seconds gauge",
+        f'cross_notifier_last_run_timestamp_seconds{{strategy="{strategy}"}} {summary.finished_at.replace(tzinfo=timezone.utc).timestamp():.0f}',
+        "# HELP cross_notifier_run_duration_seconds 直近の実行時間",
+        "# TYPE cross_notifier_run_duration_seconds gauge",
+        f'cross_notifier_run_duration_seconds{{strategy="{strategy}"}} {(summary.finished_at - summary.started_at).total_seconds():.6f}',
+    ]
+    for name, key in [("symbols_processed", "symbols_processed"), ("fetch_failures", "fetch_failures"),
+                      ("emails_sent", "emails_sent"), ("emails_failed", "emails_failed")]:
+        lines += [
+            f"# TYPE cross_notifier_{name} gauge",
+            f'cross_notifier_{name}{{strategy="{strategy}"}} {getattr(summary, key) or 0}',
+        ]
+    calls = json.loads(summary.stage_calls or "{}")
+    lines += ["# HELP cross_notifier_stage_seconds 直近の実行における処理段階ごとの合計時間",
+              "# TYPE cross_notifier_stage_seconds gauge"]
+    for stage, seconds in sorted(json.loads(summary.stage_seconds or "{}").items()):
+        lines.append(f'cross_notifier_stage_seconds{{stage="{_label(stage)}"}} {seconds:.6f}')
+    lines += ["# TYPE cross_notifier_stage_calls gauge"]
+    for stage, count in sorted(calls.items()):
+        lines.append(f'cross_notifier_stage_calls{{stage="{_label(stage)}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from models import SentNotification
+
+NOTIFY_DEDUP_MINUTES = int(os.getenv("NOTIFY_DEDUP_MINUTES", "360"))  # 0 で抑止しない
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", "7"))
+
+
+# 🧾 通知台帳：実行開始時に抑止期間内の (ユーザー, 銘柄) を1回のクエリで集合に読み込み、
+# 実行中の判定はメモリ上だけで行う。送信できた分は実行の最後にまとめて書き込む
+class NotificationLedger:
+    def __init__(self, session, strategy_name, window_minutes=NOTIFY_DEDUP_MINUTES, now=None):
+        self.session = session
+        self.strategy_name = strategy_name
+        self.window = timedelta(minutes=window_minutes)
+        self.now = now or datetime.utcnow()
+        self.sent = set()
+        self.pending = {}
+        self.suppressed = 0
+
+    def load(self):
+        if not self.window:
+            return self
+        rows = (self.session.query(SentNotification.user_id, SentNotification.symbol)
+                .filter(SentNotification.strategy == self.strategy_name,
+                        SentNotification.sent_at >= self.now - self.window))
+        # 読むだけなのでコミットしない（コミットすると読み込み済みの User が失効し、1人ずつ読み直しになる）
+        self.sent = {(user_id, symbol) for user_id, symbol in rows}
+        return self
+
+    # 抑止期間内に送っていない結果だけを残す
+    def fresh(self, user_id, results):
+        kept = [(symbol, signal) for symbol, signal in results if (user_id, symbol) not in self.sent]
+        self.suppressed += len(results) - len(kept)
+        return kept
+
+    # 実際に送信キューへ入れた宛先だけ記録する（メール未登録のユーザーは記録しない）
+    def record(self, user, results):
+        if not user.email:
+            return
+        self.pending.setdefault(user.id, (user.email, []))[1].extend(symbol for symbol, _ in results)
+
+    # 送信に失敗した宛先の分は書かない（次の実行で再送される）
+    def save(self, failed_emails=()):
+        failed = set(failed_emails)
+        rows = [
+            {"user_id": user_id, "symbol": symbol, "strategy": self.strategy_name, "sent_at": self.now}
+            for user_id, (email, symbols) in self.pending.items() if email not in failed
+            for symbol in symbols
+        ]
+        keys = [(row["user_id"], row["symbol"]) for row in rows]
+        if rows:
+            # 1行ずつの INSERT ではなく1回の executemany で書く
+            self.session.execute(insert(SentNotification), rows)
+        self.session.commit()
+        self.sent.update(keys)
+        self.pending = {}
+        if self.suppressed:
+            print(f"🧾 抑止期間内の重複通知 {self.suppressed}件を除外しました", flush=True)
+        return len(rows)
+
+    def evict(self, retention_days=LEDGER_RETENTION_DAYS):
+        cutoff = self.now - max(timedelta(days=retention_days), self.window)
+        deleted = self.session.query(SentNotification).filter(SentNotification.sent_at < cutoff).delete()
+        self.session.commit()
+        return deleted
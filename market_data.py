@@ -0,0 +1,146 @@
+import json
+import os
+import random
+import re
+import threading
+import time as time_module
+
+from bar_cache import BarCache
+from fetcher import yfinance_transport
+from symbol_directory import yfinance_info
+
+MARKET_DATA = os.getenv("MARKET_DATA", "yfinance")  # yfinance / record / replay
+MARKET_DATA_PATH = os.getenv("MARKET_DATA_PATH", "market_data.db")
+REPLAY_LATENCY = float(os.getenv("REPLAY_LATENCY", "0"))
+REPLAY_JITTER = float(os.getenv("REPLAY_JITTER", "0"))
+REPLAY_ERROR_RATE = float(os.getenv("REPLAY_ERROR_RATE", "0"))
+REPLAY_RATE_LIMIT_RATE = float(os.getenv("REPLAY_RATE_LIMIT_RATE", "0"))
+
+
+# 📡 市場データの取得元（足の一括取得 download と銘柄情報 info の2つだけを持つ）
+# per_symbol_calls は download が銘柄ごとに HTTP を送るかどうか（BatchFetcher のレート制限に使う）
+class YFinanceProvider:
+    per_symbol_calls = True
+
+    def download(self, tickers, period="5d", interval="5m", start=None):
+        return yfinance_transport(tickers, period=period, interval=interval, start=start)
+
+    def info(self, symbol):
+        return yfinance_info(symbol)
+
+
+# 記録ファイル：足は BarCache と同じ bars 表（銘柄×足種×時刻で重複なし）、銘柄情報は JSON で保存
+class Recording:
+    def __init__(self, path):
+        self.bars = BarCache(path, check_same_thread=False)
+        self.conn = self.bars.conn
+        self.conn.execute("CREATE TABLE IF NOT EXISTS securities (symbol TEXT PRIMARY KEY, info TEXT NOT NULL)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.bars.close()
+
+    def save_frames(self, frames, interval):
+        with self._lock:
+            for sym, df in frames.items():
+                self.bars.upsert(sym, interval, df)
+
+    def save_info(self, symbol, info):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO securities VALUES (?, ?)",
+                              (symbol, json.dumps(info, ensure_ascii=False)))
+            self.conn.commit()
+
+    def load_frames(self, tickers, interval, days=None, start=None):
+        frames = {}
+        with self._lock:
+            for sym in tickers:
+                df = self.bars.load(sym, interval, days=days)
+                if start is not None:
+                    df = df[df.index >= start]
+                if not df.empty:
+                    frames[sym] = df
+        return frames
+
+    def load_info(self, symbol):
+        with self._lock:
+            row = self.conn.execute("SELECT info FROM securities WHERE symbol = ?", (symbol,)).fetchone()
+        if row is None:
+            raise LookupError(f"{symbol} は記録されていません")
+        return json.loads(row[0])
+
+
+# ⏺ 実際の取得元の応答をそのまま返しつつ記録する
+class RecordingProvider:
+    def __init__(self, inner, path=MARKET_DATA_PATH):
+        self.inner = inner
+        self.per_symbol_calls = getattr(inner, "per_symbol_calls", False)
+        self.recording = Recording(path)
+
+    def download(self, tickers, period="5d", interval="5m", start=None):
+        frames = self.inner.download(tickers, period=period, interval=interval, start=start)
+        self.recording.save_frames(frames, interval)
+        return frames
+
+    def info(self, symbol):
+        info = self.inner.info(symbol)
+        self.recording.save_info(symbol, info)
+        return info
+
+
+# yfinance の period（"5d" / "1mo" など）を営業日数に換算（"max" などは全期間）
+def period_days(period):
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", period or "")
+    if not match:
+        return None
+    n, unit = int(match.group(1)), match.group(2)
+    return n * {"d": 1, "wk": 5, "mo": 21, "y": 250}[unit]
+
+
+# ▶️ 記録から応答する（1リクエストごとに遅延・エラー・429 を確率的に再現）
+class ReplayProvider:
+    def __init__(self, path=MARKET_DATA_PATH, latency=REPLAY_LATENCY, jitter=REPLAY_JITTER,
+                 error_rate=REPLAY_ERROR_RATE, rate_limit_rate=REPLAY_RATE_LIMIT_RATE, seed=None,
+                 sleep=time_module.sleep):
+        self.recording = Recording(path)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _simulate(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            roll = self.random.random()
+        if delay > 0:
+            self.sleep(delay)
+        if roll < self.rate_limit_rate:
+            raise RuntimeError("429 Too Many Requests (replay)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise RuntimeError("simulated error (replay)")
+
+    def download(self, tickers, period="5d", interval="5m", start=None):
+        self._simulate()
+        days = None if start is not None else period_days(period)
+        return self.recording.load_frames(tickers, interval, days=days, start=start)
+
+    def info(self, symbol):
+        self._simulate()
+        return self.recording.load_info(symbol)
+
+
+# MARKET_DATA に応じた取得元を作る
+def market_data_provider(mode=None, path=None):
+    mode = mode or MARKET_DATA
+    path = path or MARKET_DATA_PATH
+    if mode == "record":
+        return RecordingProvider(YFinanceProvider(), path)
+    if mode == "replay":
+        return ReplayProvider(path)
+    return YFinanceProvider()
@@ -11,3 +11,86 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(255), nullable=True)
     symbols = db.Column(db.Text, nullable=True)
     notify_enabled = db.Column(db.Boolean, default=True)
+    subscriptions = db.relationship("Subscription", backref="user", cascade="all, delete-orphan")
+    strategy_subscriptions = db.relationship("StrategySubscription", cascade="all, delete-orphan")
+
+# 銘柄 → 購読ユーザーの逆引き用（User.symbols を正規化したもの）
+class Subscription(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    symbol = db.Column(db.String(20), primary_key=True, index=True)
+
+# ユーザーが受け取る戦略（行が1つもないユーザーは全戦略を受け取る）
+class StrategySubscription(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    strategy = db.Column(db.String(100), primary_key=True)
+
+# 銘柄名などのメタデータ（通知時に yfinance へ毎回問い合わせないためのキャッシュ）
+class Security(db.Model):
+    symbol = db.Column(db.String(20), primary_key=True)
+    name = db.Column(db.String(255), nullable=True)
+    market = db.Column(db.String(50), nullable=True)
+    sector = db.Column(db.String(100), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True, index=True)
+
+# 実行ごとのサマリー（/metrics で最新分を公開）
+class RunSummary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    strategy = db.Column(db.String(100), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False, index=True)
+    status = db.Column(db.String(20), default="ok")
+    symbols_processed = db.Column(db.Integer, default=0)
+    fetch_failures = db.Column(db.Integer, default=0)
+    emails_sent = db.Column(db.Integer, default=0)
+    emails_failed = db.Column(db.Integer, default=0)
+    stage_seconds = db.Column(db.Text, nullable=True)
+    stage_calls = db.Column(db.Text, nullable=True)
+
+# 複数ワーカーで分担する戦略実行の単位（戦略×実行枠ごとに1行。最初に作ったワーカーの行を全員が使う）
+class BotRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    strategy = db.Column(db.String(100), nullable=False)
+    slot = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), default="running")  # running / notifying / done
+    shard_count = db.Column(db.Integer, nullable=False)
+    aggregator = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.UniqueConstraint("strategy", "slot"),)
+
+# 銘柄シャードのリース（期限切れのものは他のワーカーが取り直せる）
+class ShardLease(db.Model):
+    run_id = db.Column(db.Integer, db.ForeignKey("bot_run.id", ondelete="CASCADE"), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    symbols = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="pending", index=True)  # pending / leased / done / failed
+    owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+# シャードごとの評価結果（集約役がここから通知をまとめる）
+class ShardResult(db.Model):
+    run_id = db.Column(db.Integer, db.ForeignKey("bot_run.id", ondelete="CASCADE"), primary_key=True)
+    symbol = db.Column(db.String(20), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False)
+    signal = db.Column(db.Text, nullable=False)
+
+# 銘柄ごとの最新の指標値とシグナル（実行のたびに上書き。ダッシュボードの JSON API はここだけを読む）
+class SignalSnapshot(db.Model):
+    symbol = db.Column(db.String(20), primary_key=True)
+    run_id = db.Column(db.Integer, nullable=False, index=True)  # 書き込んだ実行の RunSummary.id
+    strategy = db.Column(db.String(100), nullable=True)
+    as_of = db.Column(db.DateTime, nullable=True)  # 最終足の時刻（UTC）
+    indicators = db.Column(db.Text, nullable=False)  # JSON
+    signal = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# 送信済み通知の台帳（ユーザー×銘柄×戦略。一定時間内の同じ通知を抑止するために実行開始時にまとめて読む）
+class SentNotification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    symbol = db.Column(db.String(20), nullable=False)
+    strategy = db.Column(db.String(100), nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = (db.Index("ix_sent_notification_strategy_sent_at", "strategy", "sent_at"),)
@@ -0,0 +1,149 @@
+import os
+import random
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from instrumentation import metrics
+
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+
+
+# ✉️ SendGrid 送信（クライアントは1つを使い回し、同一内容は宛先ごとの personalization で1リクエストに）
+class SendGridBackend:
+    max_recipients = 1000
+
+    def __init__(self, api_key=None, from_email=None):
+        from sendgrid import SendGridAPIClient
+
+        self.client = SendGridAPIClient(api_key or os.getenv("SENDGRID_API_KEY"))
+        self.from_email = from_email or os.getenv("SENDGRID_FROM_EMAIL")
+
+    def send(self, recipients, subject, body):
+        from sendgrid.helpers.mail import Mail
+
+        message = Mail(from_email=self.from_email, to_emails=list(recipients), subject=subject,
+                       plain_text_content=body, is_multiple=True)
+        response = self.client.send(message)
+        if response.status_code >= 300:
+            raise RuntimeError(f"SendGrid status {response.status_code}")
+        return response.status_code
+
+
+# 🧪 負荷試験用のダミー送信先（遅延・失敗率を指定可能）
+class FakeBackend:
+    max_recipients = 1000
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, recipients, subject, body):
+        if self.latency:
+            time_module.sleep(self.latency)
+        with self._lock:
+            if self.random.random() < self.failure_rate:
+                raise RuntimeError("fake backend failure")
+            self.sent.append((tuple(recipients), subject, body))
+        return 202
+
+
+# 🌐 ローカルの HTTP シンクへ POST する送信先（Keep-Alive のセッションを使い回す）
+class HttpSinkBackend:
+    max_recipients = 1000
+
+    def __init__(self, url):
+        import requests
+
+        self.url = url
+        self.session = requests.Session()
+
+    def send(self, recipients, subject, body):
+        response = self.session.post(self.url, json={"to": list(recipients), "subject": subject, "body": body}, timeout=10)
+        response.raise_for_status()
+        return response.status_code
+
+
+@dataclass
+class DispatchStats:
+    queued: int = 0
+    sent: int = 0
+    failed: int = 0
+    api_calls: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    failed_recipients: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+# 📮 通知をキューに溜め、同一内容をまとめて並列送信するディスパッチャ
+class Dispatcher:
+    def __init__(self, backend=None, workers=NOTIFY_WORKERS, batch_size=NOTIFY_BATCH_SIZE,
+                 max_retries=NOTIFY_MAX_RETRIES, backoff_base=0.5, sleep=time_module.sleep):
+        self.backend = backend or SendGridBackend()
+        self.workers = workers
+        self.batch_size = min(batch_size, getattr(self.backend, "max_recipients", batch_size))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._sleep = sleep
+        self._queue = {}
+        self.stats = DispatchStats()
+
+    # キューに入れたら True（宛先が無ければ False）
+    def enqueue(self, to_email, subject, body):
+        if not to_email:
+            return False
+        self._queue.setdefault((subject, body), []).append(to_email)
+        self.stats.queued += 1
+        return True
+
+    def flush(self):
+        batches = []
+        for (subject, body), recipients in self._queue.items():
+            recipients = list(dict.fromkeys(recipients))
+            for i in range(0, len(recipients), self.batch_size):
+                batches.append((recipients[i:i + self.batch_size], subject, body))
+        self._queue = {}
+        if not batches:
+            return self.stats
+
+        started = time_module.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            outcomes = list(executor.map(self._send_batch, batches))
+        self.stats.elapsed += time_module.perf_counter() - started
+
+        for (recipients, _, _), (ok, attempts) in zip(batches, outcomes):
+            self.stats.api_calls += attempts
+            self.stats.retries += attempts - 1
+            if ok:
+                self.stats.sent += len(recipients)
+            else:
+                self.stats.failed += len(recipients)
+                self.stats.failed_recipients.extend(recipients)
+        print(f"📮 送信完了: {self.stats.sent}通 / 失敗{self.stats.failed}通 / API{self.stats.api_calls}回 "
+              f"({self.stats.throughput:.1f}通/秒)", flush=True)
+        return self.stats
+
+    def _send_batch(self, batch):
+        recipients, subject, body = batch
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                with metrics.timer("email.send"):
+                    self.backend.send(recipients, subject, body)
+                metrics.incr("emails_sent", len(recipients))
+                return True, attempt
+            except Exception as e:
+                print(f"メール送信エラー({len(recipients)}件, {attempt}回目):", e, flush=True)
+                if attempt > self.max_retries:
+                    metrics.incr("emails_failed", len(recipients))
+                    return False, attempt
+                self._sleep(self.backoff_base * (2 ** (attempt - 1)))
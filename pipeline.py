@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time as time_module
+from dataclasses import dataclass
+
+from bar_cache import plan_incremental
+from instrumentation import metrics, log, DEBUG, WARNING
+
+PIPELINE_FETCH_CONCURRENCY = int(os.getenv("PIPELINE_FETCH_CONCURRENCY", "4"))
+PIPELINE_EVAL_CONCURRENCY = int(os.getenv("PIPELINE_EVAL_CONCURRENCY", "1"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "256"))
+PIPELINE_CHUNK_SIZE = int(os.getenv("PIPELINE_CHUNK_SIZE", "50"))
+
+
+@dataclass
+class PipelineStats:
+    fetched: int = 0
+    evaluated: int = 0
+    notified: int = 0
+    first_notification: float = None
+    elapsed: float = 0.0
+
+
+# 🔀 取得 → 評価 → 通知 を上限付きキューでつなぎ、各段を重ねて実行するパイプライン
+class AsyncPipeline:
+    def __init__(self, fetcher, bar_cache, evaluate, notify, flush, interval="5m", period="5d", days=5,
+                 fetch_concurrency=PIPELINE_FETCH_CONCURRENCY, eval_concurrency=PIPELINE_EVAL_CONCURRENCY,
+                 queue_size=PIPELINE_QUEUE_SIZE, chunk_size=PIPELINE_CHUNK_SIZE):
+        self.fetcher = fetcher
+        self.bar_cache = bar_cache
+        self.evaluate = evaluate
+        self.notify = notify
+        self.flush = flush
+        self.interval = interval
+        self.period = period
+        self.days = days
+        self.fetch_concurrency = fetch_concurrency
+        self.eval_concurrency = eval_concurrency
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.stats = PipelineStats()
+
+    def run(self, symbol_index):
+        return asyncio.run(self._run(symbol_index))
+
+    async def _run(self, symbol_index):
+        self._started = time_module.perf_counter()
+        self._index = symbol_index
+        self._remaining = {}
+        self._results = {}
+        for users in symbol_index.values():
+            for user in users:
+                self._remaining[user.id] = self._remaining.get(user.id, 0) + 1
+                self._results.setdefault(user.id, (user, []))
+
+        # sqlite 接続はイベントループのスレッドだけで使い、ネットワーク待ちだけをスレッドに逃がす
+        tickers = sorted(s + ".T" for s in symbol_index)
+        _, plans = plan_incremental(self.bar_cache, tickers, self.interval, self.period)
+        fetch_q = asyncio.Queue()
+        for syms, kwargs in plans:
+            for i in range(0, len(syms), self.chunk_size):
+                fetch_q.put_nowait((syms[i:i + self.chunk_size], kwargs))
+        eval_q = asyncio.Queue(maxsize=self.queue_size)
+        notify_q = asyncio.Queue(maxsize=self.queue_size)
+
+        fetchers = [asyncio.create_task(self._fetch_worker(fetch_q, eval_q)) for _ in range(self.fetch_concurrency)]
+        evaluators = [asyncio.create_task(self._eval_worker(eval_q, notify_q)) for _ in range(self.eval_concurrency)]
+        notifier = asyncio.create_task(self._notify_worker(notify_q))
+
+        await asyncio.gather(*fetchers)
+        for _ in evaluators:
+            await eval_q.put(None)
+        await asyncio.gather(*evaluators)
+        await notify_q.put(None)
+        await notifier
+
+        self.stats.elapsed = time_module.perf_counter() - self._started
+        first = f"{self.stats.first_notification:.1f}秒" if self.stats.first_notification is not None else "なし"
+        print(f"🔀 パイプライン完了: 取得{self.stats.fetched} / 評価{self.stats.evaluated} / 通知{self.stats.notified}件 "
+              f"（初回通知まで {first}, 合計 {self.stats.elapsed:.1f}秒）", flush=True)
+        return self.stats
+
+    async def _fetch_worker(self, fetch_q, eval_q):
+        while not fetch_q.empty():
+            chunk, kwargs = fetch_q.get_nowait()
+            result = await asyncio.to_thread(self.fetcher.fetch, chunk, **kwargs)
+            metrics.incr("fetch_failures", len(result.failed))
+            for sym in chunk:
+                if sym in result.data:
+                    self.bar_cache.upsert(sym, self.interval, result.data[sym])
+                    self.stats.fetched += 1
+                df = self.bar_cache.load(sym, self.interval, days=self.days)
+                await eval_q.put((sym, df))
+
+    async def _eval_worker(self, eval_q, notify_q):
+        while True:
+            item = await eval_q.get()
+            if item is None:
+                break
+            sym, df = item
+            code = sym[:-2]
+            signal = None
+            if df.empty:
+                log(WARNING, "⚠️ %s のデータが取得できませんでした", code)
+            else:
+                signal = await asyncio.to_thread(self.evaluate, code, df)
+                self.stats.evaluated += 1
+                metrics.incr("symbols_processed")
+                if not signal:
+                    log(DEBUG, "🔍 %s → シグナルなし", code)
+
+            # 購読ユーザーの全銘柄が揃った時点で通知キューへ
+            for user in self._index.get(code, []):
+                if signal:
+                    self._results[user.id][1].append((code, signal))
+                self._remaining[user.id] -= 1
+                if self._remaining[user.id] == 0 and self._results[user.id][1]:
+                    await notify_q.put(self._results[user.id])
+
+    async def _notify_worker(self, notify_q):
+        done = False
+        while not done:
+            batch = [await notify_q.get()]
+            while not notify_q.empty():
+                batch.append(notify_q.get_nowait())
+            for item in batch:
+                if item is None:
+                    done = True
+                    continue
+                user, results = item
+                self.notify(user, sorted(results))
+                self.stats.notified += 1
+            if self.stats.notified:
+                await asyncio.to_thread(self.flush)
+                if self.stats.first_notification is None:
+                    self.stats.first_notification = time_module.perf_counter() - self._started
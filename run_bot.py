@@ -1,26 +1,47 @@
+import json
+import math
 import os
-import time as time_module
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from flask import Flask
 from sqlalchemy.orm import scoped_session, sessionmaker
 from dotenv import load_dotenv
 from zoneinfo import ZoneInfo
 import holidays
-import pandas as pd
-import yfinance as yf
-import pandas_ta as ta
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from models import db, User
+import numpy as np
+
+load_dotenv()
+
+from models import db
+from subscriptions import (backfill_subscriptions, build_symbol_index, build_strategy_index, fan_out, wants_strategy,
+                           STRATEGY_NAMES)
+from symbol_directory import SymbolDirectory
+from notifier import Dispatcher
+from fetcher import BatchFetcher
+from market_data import market_data_provider
+from bar_cache import BarCache, fetch_incremental
+from indicators import IndicatorEngine, SymbolIndicators, required_bars
+from executor import ShardedEvaluator
+import streaming
+import vectorized
+from pipeline import AsyncPipeline
+from coordination import ShardCoordinator, run_shards, SHARD_COUNT
+from snapshots import compute_snapshot, save_snapshot
+from ledger import NotificationLedger
+from instrumentation import metrics, log, log_enabled, save_run_summary, DEBUG, WARNING
 
 # Flask & 環境設定
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
 db.init_app(app)
 
-load_dotenv()
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-SENDGRID_FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL")
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "50"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "4"))
+FETCH_MAX_RETRIES = int(os.getenv("FETCH_MAX_RETRIES", "3"))
+BAR_CACHE_PATH = os.getenv("BAR_CACHE_PATH", "bars.db")
+BAR_RETENTION_DAYS = int(os.getenv("BAR_RETENTION_DAYS", "10"))
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "phased")  # phased / async
+EVAL_MODE = os.getenv("EVAL_MODE", "per_symbol")  # per_symbol / vectorized（EVAL_WORKERS>1 でプロセス並列）
 
 # ⏰ 実行戦略マップ
 TIME_STRATEGY_MAP = {
@@ -36,87 +57,92 @@ TIME_STRATEGY_MAP = {
     "14:30": "クロージング・サージ・スナイパー"
 }
 
-# メール送信
-def send_email(to_email, subject, body):
-    message = Mail(from_email=SENDGRID_FROM_EMAIL, to_emails=to_email, subject=subject, plain_text_content=body)
-    try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        print(f"✅ メール送信成功: {to_email} {response.status_code}")
-    except Exception as e:
-        print("メール送信エラー:", e, flush=True)
+# 検出関数は DataFrame でも BarStore のビューでも動くよう、列をコピーせずに読む
+# df.dropna().iloc[-1] 相当：足と指標がすべて揃っている最後の行の位置（なければ IndexError）
+def last_complete(df, *series):
+    complete = np.logical_and.reduce([df[col].notna().to_numpy() for col in df.columns]
+                                     + [s.notna().to_numpy() for s in series])
+    return np.flatnonzero(complete)[-1]
+
+
+# 💬 通知文言（検出関数・ストリーミング・一括評価で共通。{ratio} は評価関数が返す値で埋める）
+RSI_STOCH_MESSAGE = "RSI+ストキャス弱気圏 → チャンスの兆しかも"
+MA_RSI_MESSAGE = "移動平均が交差気味 & RSIやや上向き → 弱めの買いシグナル"
+VOLUME_RSI_BREAKOUT_MESSAGE = "出来高↑ + 高値接近 + RSIやや強 → ゆる買いサイン"
+ATR_LOW_VOLATILITY_MESSAGE = "ATR低下 → ボラティリティ低下と判断"
+MACD_REVERSAL_MESSAGE = "MACD微差で上 → 弱めの上昇シグナル"
+CLOSING_SURGE_MESSAGE = "出来高が平均の{ratio:.1f}倍 → ゆる急騰の可能性"
+
 
 # ✅ RSI + ストキャスでの超ゆる買いシグナル
 
-def detect_rsi_stoch_signal(df):
-    df = df.copy()
-    df["RSI"] = ta.rsi(df["Close"], length=14)
-    stoch = ta.stoch(df["High"], df["Low"], df["Close"], k=14, d=3)
+def detect_rsi_stoch_signal(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    rsi = ind.rsi(14)
+    stoch = ind.stoch(14, 3)
 
     if stoch is None or stoch.isnull().values.any():
         return None
 
-    df[["STOCH_K", "STOCH_D"]] = stoch.values
-    latest = df.dropna().iloc[-1]
+    stoch_k, stoch_d = stoch.iloc[:, 0], stoch.iloc[:, 1]
+    i = last_complete(df, rsi, stoch_k, stoch_d)
 
     # 🎯 RSI < 50 & ストキャスK < 50 → ちょっと下がってるかも！？
-    if latest.RSI < 50 and latest.STOCH_K < 50:
-        return "RSI+ストキャス弱気圏 → チャンスの兆しかも"
+    if rsi.iloc[i] < 50 and stoch_k.iloc[i] < 50:
+        return RSI_STOCH_MESSAGE
 
     return None
 
 # ✅ SMA + RSI 弱い買い傾向でも通知
 
-def detect_ma_rsi_signal(df):
-    df = df.copy()
-    df["SMA5"] = df["Close"].rolling(5).mean()
-    df["SMA10"] = df["Close"].rolling(10).mean()
-    df["RSI"] = ta.rsi(df["Close"], length=14)
-    latest = df.dropna().iloc[-1]
+def detect_ma_rsi_signal(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    sma5 = ind.sma(5)
+    sma10 = ind.sma(10)
+    rsi = ind.rsi(14)
+    i = last_complete(df, sma5, sma10, rsi)
 
     # 🎯 SMA5 ≧ SMA10 & RSI > 40
-    if latest.SMA5 >= latest.SMA10 and latest.RSI > 40:
-        return "移動平均が交差気味 & RSIやや上向き → 弱めの買いシグナル"
+    if sma5.iloc[i] >= sma10.iloc[i] and rsi.iloc[i] > 40:
+        return MA_RSI_MESSAGE
 
     return None
 
 # ✅ 出来高 + RSI + 高値ブレイク（条件ゆるめ）
 
-def detect_volume_rsi_breakout(df):
-    df = df.copy()
-    df["RSI"] = ta.rsi(df["Close"], length=14)
-    df["Vol_Avg"] = df["Volume"].rolling(10).mean()
-    high_break = df["Close"] >= df["High"].shift(1).rolling(10).max() * 0.995
-    latest = df.dropna().iloc[-1]
+def detect_volume_rsi_breakout(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    rsi = ind.rsi(14)
+    vol_avg = ind.volume_avg(10)
+    high_break = df["Close"].iloc[-1] >= ind.prior_high(10).iloc[-1] * 0.995
+    i = last_complete(df, rsi, vol_avg)
 
-    if latest.Volume > latest.Vol_Avg * 1.1 and latest.RSI > 40 and high_break.iloc[-1]:
-        return "出来高↑ + 高値接近 + RSIやや強 → ゆる買いサイン"
+    if df["Volume"].iloc[i] > vol_avg.iloc[i] * 1.1 and rsi.iloc[i] > 40 and high_break:
+        return VOLUME_RSI_BREAKOUT_MESSAGE
 
     return None
 
 # ✅ MACDでの上昇転換・継続シグナル（緩め）
 
-def detect_macd_reversal(df):
-    df = df.copy()
-    macd = ta.macd(df["Close"])
+def detect_macd_reversal(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    macd = ind.macd()
 
     if macd is None or macd.isnull().values.all():
         return None
 
     try:
-        df[["MACD", "Signal", "Hist"]] = macd
-        df = df.dropna(subset=["MACD", "Signal"])  # ここ重要！
+        # 列は位置で読む（2列目＝ヒストグラムを "Signal" として比較する従来の挙動のまま）
+        line, signal = macd.iloc[:, 0].to_numpy(), macd.iloc[:, 1].to_numpy()
+        valid = np.flatnonzero(~np.isnan(line) & ~np.isnan(signal))  # ここ重要！
 
-        if len(df) < 2:
+        if len(valid) < 2:
             return None
 
-        prev, curr = df.iloc[-2], df.iloc[-1]
-
-        if pd.isna(curr.MACD) or pd.isna(curr.Signal):
-            return None
+        curr = valid[-1]
 
-        if curr.MACD > curr.Signal:
-            return "MACD微差で上 → 弱めの上昇シグナル"
+        if line[curr] > signal[curr]:
+            return MACD_REVERSAL_MESSAGE
     except Exception as e:
         print(f"❌ MACDエラー: {e}", flush=True)
         return None
@@ -126,62 +152,240 @@ def detect_macd_reversal(df):
 
 # ✅ 引け前に出来高が急増している銘柄を検出（2倍 → 1.2倍に緩和）
 
-def detect_closing_surge(df):
-    df = df.copy()
-    df["Vol_Avg"] = df["Volume"].rolling(window=20).mean()
-    latest = df.dropna().iloc[-1]
-    ratio = latest["Volume"] / latest["Vol_Avg"] if latest["Vol_Avg"] > 0 else 0
+def detect_closing_surge(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    vol_avg = ind.volume_avg(20)
+    i = last_complete(df, vol_avg)
+    ratio = df["Volume"].iloc[i] / vol_avg.iloc[i] if vol_avg.iloc[i] > 0 else 0
 
     if ratio > 1.2:
-        return f"出来高が平均の{ratio:.1f}倍 → ゆる急騰の可能性"
+        return CLOSING_SURGE_MESSAGE.format(ratio=ratio)
 
     return None
 
 
-def detect_atr_low_volatility(df):
-    df = df.copy()
-    df["ATR"] = ta.atr(df["High"], df["Low"], df["Close"], length=14)
-    return "ATR低下 → ボラティリティ低下と判断" if df["ATR"].iloc[-1] < df["ATR"].iloc[-10:-5].mean() * 0.6 else None
+def detect_atr_low_volatility(df, ind=None):
+    ind = ind or SymbolIndicators.standalone(df)
+    atr = ind.atr(14)
+    return ATR_LOW_VOLATILITY_MESSAGE if atr.iloc[-1] < atr.iloc[-10:-5].mean() * 0.6 else None
+
+
+# 📋 戦略レジストリ（戦略を足すときはここに1件追加するだけ）
+# detect: DataFrame 版の検出関数 / streaming: 常駐モードの状態判定 / vectorized: 最新足の一括判定 /
+# backtest: 全足の一括判定。streaming と vectorized は判定か (判定, {文言の値}) を返す
+@dataclass(frozen=True)
+class Strategy:
+    detect: object
+    indicators: tuple
+    message: str
+    subject: str
+    intro: str
+    streaming: object
+    vectorized: object
+    backtest: object
+    extra_bars: int = 0
+
+    @property
+    def lookback(self):
+        return max(required_bars(name, params) for name, params in self.indicators) + self.extra_bars
+
+    # ストリーミング状態から通知文言（ヒットしなければ None）
+    def evaluate_state(self, state):
+        result = self.streaming(state)
+        hit, values = result if isinstance(result, tuple) else (result, {})
+        return self.message.format(**values) if hit else None
+
+
+STRATEGIES = {
+    "オープニング逆張りスナイパー": Strategy(
+        detect_rsi_stoch_signal, (("rsi", (14,)), ("stoch", (14, 3))), RSI_STOCH_MESSAGE,
+        "【逆張りチャンス】寄付き直後の買いシグナル", "🔍 寄付き直後の逆張り買いシグナルが出ました！",
+        streaming.rsi_stoch_state, vectorized.rsi_stoch_mask, vectorized.rsi_stoch_signals),
+    "モーニングトレンドハンター": Strategy(
+        detect_ma_rsi_signal, (("sma", (5,)), ("sma", (10,)), ("rsi", (14,))), MA_RSI_MESSAGE,
+        "【上昇トレンド開始】朝の上昇を先取り！", "📈 初動の上昇トレンドを捉える買いシグナルです！",
+        streaming.ma_rsi_state, vectorized.ma_rsi_mask, vectorized.ma_rsi_signals),
+    "ボリュームライディングブレイカー": Strategy(
+        detect_volume_rsi_breakout, (("rsi", (14,)), ("volume_avg", (10,)), ("prior_high", (10,))),
+        VOLUME_RSI_BREAKOUT_MESSAGE,
+        "【出来高急増】ブレイクアウトの兆し", "🔥 出来高急増＋トレンド形成中！買い圧力の高まりを示しています。",
+        streaming.volume_rsi_breakout_state, vectorized.volume_rsi_breakout_mask,
+        vectorized.volume_rsi_breakout_signals),
+    # atr.iloc[-10:-5] と比べるので 9 本余分に遡る
+    "サイレント・ゾーン・スキャナー": Strategy(
+        detect_atr_low_volatility, (("atr", (14,)),), ATR_LOW_VOLATILITY_MESSAGE,
+        "【静寂の中の兆候】低ボラ状態からの上昇準備", "🧘 市場が静かな今、次の上昇に備えるチャンスを示しています。",
+        streaming.atr_low_volatility_state, vectorized.atr_low_volatility_mask,
+        vectorized.atr_low_volatility_signals, extra_bars=9),
+    # MACD とヒストグラムが2本以上揃う必要がある
+    "リバーサル・シーカー": Strategy(
+        detect_macd_reversal, (("macd", (12, 26, 9)),), MACD_REVERSAL_MESSAGE,
+        "【反転サイン】底打ちの兆しを検出", "🔄 トレンド反転の兆候あり！今がエントリーの好機かもしれません。",
+        streaming.macd_reversal_state, vectorized.macd_reversal_mask, vectorized.macd_reversal_signals,
+        extra_bars=1),
+    "クロージング・サージ・スナイパー": Strategy(
+        detect_closing_surge, (("volume_avg", (20,)),), CLOSING_SURGE_MESSAGE,
+        "【引け前急騰】買いの勢いを捉えろ！", "🚀 引け前に出来高と価格が急上昇！買いのタイミングを知らせます。",
+        streaming.closing_surge_state, vectorized.closing_surge_mask, vectorized.closing_surge_signals),
+}
+
+# Web 側（run_bot を読み込まない）の戦略名と実行時刻表がレジストリとずれていたら起動時に止める
+if tuple(STRATEGIES) != STRATEGY_NAMES:
+    raise RuntimeError("subscriptions.STRATEGY_NAMES と run_bot.STRATEGIES の戦略名・順序が一致しません")
+if not set(TIME_STRATEGY_MAP.values()) <= set(STRATEGIES):
+    raise RuntimeError(f"TIME_STRATEGY_MAP に未登録の戦略があります: {set(TIME_STRATEGY_MAP.values()) - set(STRATEGIES)}")
+
+BARS_PER_DAY = {"5m": 66, "15m": 22, "30m": 11, "60m": 6, "1h": 6, "1d": 1}
+
+
+# これから実行する戦略の要件の和（指標・必要本数・取得日数）
+@dataclass(frozen=True)
+class StrategyPlan:
+    names: tuple
+    indicators: tuple
+    lookback: int
+
+    # 当日の足が少ない時間帯でも lookback 本を満たすよう1日ぶん余裕を持たせる
+    def days(self, interval="5m"):
+        return math.ceil(self.lookback / BARS_PER_DAY.get(interval, 1)) + 1
+
+
+def plan_strategies(names):
+    names = tuple(n for n in names if n in STRATEGIES)
+    indicators = []
+    for name in names:
+        for requirement in STRATEGIES[name].indicators:
+            if requirement not in indicators:
+                indicators.append(requirement)
+    lookback = max((STRATEGIES[n].lookback for n in names), default=0)
+    return StrategyPlan(names, tuple(indicators), lookback)
 
 
 
 # ユーティリティ
-def batch(iterable, size):
-    it = iter(iterable)
-    while True:
-        chunk = list([next(it, None) for _ in range(size)])
-        chunk = [i for i in chunk if i]
-        if not chunk:
-            break
-        yield chunk
-
-def format_email_body(results, strategy_name):
+def format_email_body(results, strategy_name, directory):
     now_jst = datetime.utcnow() + timedelta(hours=9)
     timestamp = now_jst.strftime("%Y-%m-%d %H:%M:%S")
     body = f"\n【戦略】{strategy_name}\n通知時刻（日本時間）: {timestamp}\n"
     for symbol, signal in results:
         full = symbol + ".T"
-        try:
-            name = yf.Ticker(full).info.get("longName", "名称不明")
-        except:
-            name = "名称取得失敗"
+        name = directory.name(symbol)
         url = f"https://finance.yahoo.co.jp/quote/{full}"
         body += f"\n{symbol}\n{signal}\n{name}\n{url}\n"
     return body.strip()
 
-# メインループ（±2分対応 + シグナル無し表示）
+# 🔎 指標の確認ログ（LOG_LEVEL=DEBUG のときだけ計算・整形する）
+def log_indicator_debug(sym, df, ind):
+    df_debug = df.copy()
+
+    # 👉 RSI確認
+    try:
+        df_debug["RSI"] = ind.rsi(14)
+        latest_rsi = df_debug["RSI"].dropna().iloc[-1]
+    except:
+        latest_rsi = "取得失敗"
+
+    # 👉 MACD確認（改良版）
+    try:
+        macd = ind.macd()
+        df_debug[["MACD", "Signal", "Hist"]] = macd
+        df_macd = df_debug.dropna(subset=["MACD", "Signal"])
+        if len(df_macd) >= 1:
+            latest_macd = df_macd.iloc[-1]
+            macd_val = latest_macd.MACD
+            signal_val = latest_macd.Signal
+        else:
+            macd_val = signal_val = "NaN"
+    except Exception as e:
+        macd_val = signal_val = f"ERR: {e}"
+
+
+    # 👉 出来高平均と比率確認
+    try:
+        df_debug["Vol_Avg"] = ind.volume_avg(20)
+        latest_vol = df_debug.dropna().iloc[-1]
+        vol_ratio = latest_vol["Volume"] / latest_vol["Vol_Avg"]
+    except:
+        vol_ratio = "取得失敗"
+
+    if isinstance(vol_ratio, float):
+        log(DEBUG, "🔎 %s → RSI: %s, MACD: %s, Signal: %s, 出来高比: %.2f", sym, latest_rsi, macd_val, signal_val, vol_ratio)
+    else:
+        log(DEBUG, "🔎 %s → ログ取得失敗", sym)
+
+
+# 1銘柄ぶんのシグナル検出（plan の指標をまとめて1回計算し、plan の全戦略の検出関数を続けて呼ぶ）
+# 戻り値は {戦略名: 通知文言}（ヒットした戦略だけ）
+def evaluate_symbol(sym, df, plan, indicators):
+    ind = indicators.for_symbol(sym, df)
+    if log_enabled(DEBUG):
+        log_indicator_debug(sym, df, ind)
+
+    ind.prepare(plan.indicators)
+    hits = {}
+    for name in plan.names:
+        with metrics.timer(f"detect.{name}"):
+            signal = STRATEGIES[name].detect(df, ind)
+        if signal:
+            hits[name] = signal
+    return hits
+
+
+# 📧 ユーザーへのシグナル通知（その実行でのヒットを全銘柄まとめて1通に。ledger があれば抑止期間内の重複を除く）
+def notify_user(user, results, strategy_name, directory, dispatcher, ledger=None):
+    ledgers = {strategy_name: ledger} if ledger is not None else None
+    notify_user_strategies(user, {strategy_name: results}, directory, dispatcher, ledgers)
+
+
+def _strategy_section(strategy_name, results, directory):
+    strategy = STRATEGIES.get(strategy_name)
+    intro = strategy.intro if strategy else ""
+    body = f"【戦略】{strategy_name}\n{intro}\n"
+    for symbol, signal in results:
+        body += (f"\n銘柄コード: {symbol}\n内容: {signal}\n銘柄名: {directory.name(symbol)}\n"
+                 f"Yahooファイナンス: https://finance.yahoo.co.jp/quote/{symbol}.T\n")
+    return body
+
+
+# 📧 同じ実行で重なった戦略のヒットを戦略ごとの見出しに分けて1通にまとめる（hits は {戦略名: [(銘柄, シグナル)]}）
+# 台帳は戦略ごとのまま、重複の除外と送信済みの記録だけに使う
+def notify_user_strategies(user, hits, directory, dispatcher, ledgers=None):
+    if ledgers is not None:
+        hits = {name: ledgers[name].fresh(user.id, results) for name, results in hits.items()}
+    hits = {name: results for name, results in hits.items() if results}
+    if not hits:
+        return
+    directory.ensure(symbol for results in hits.values() for symbol, _ in results)
+
+    if len(hits) == 1:
+        (strategy_name, results), = hits.items()
+        strategy = STRATEGIES.get(strategy_name)
+        subject = strategy.subject if strategy else f"【シグナル通知】{strategy_name}"
+        if len(results) > 1:
+            subject += f"（{len(results)}銘柄）"
+    else:
+        subject = f"【シグナル通知】{len(hits)}戦略・{sum(len(results) for results in hits.values())}件"
+    body = "\n".join(_strategy_section(name, results, directory) for name, results in hits.items())
+
+    if not dispatcher.enqueue(user.email, subject, body):
+        return
+    if ledgers is not None:
+        for name, results in hits.items():
+            ledgers[name].record(user, results)
+    log(DEBUG, "📧 %s へ通知: %s", user.username, hits)
+
+# メインループ（±2分対応 + シグナル無し表示）。時刻が重なった戦略はまとめて1回で実行
 def main_loop():
     now = datetime.utcnow() + timedelta(hours=9)
     hour = now.strftime("%H")
     minute = now.minute
     candidates = [f"{hour}:{(minute + offset) % 60:02d}" for offset in [-2, -1, 0, 1, 2]]
-    strategy_name = None
+    due = {}
     for t in candidates:
         if t in TIME_STRATEGY_MAP:
-            strategy_name = TIME_STRATEGY_MAP[t]
-            break
+            due.setdefault(TIME_STRATEGY_MAP[t], t)
 
-    if not strategy_name:
+    if not due:
         print(f"⏸ 現在の時刻 {now.strftime('%H:%M')} は戦略対象外です", flush=True)
         return
 
@@ -189,182 +393,238 @@ def main_loop():
         print("⏸ 日本の休日または週末のためスキップ", flush=True)
         return
 
-    print(f"🚀 現在の戦略: {strategy_name}", flush=True)
+    print(f"🚀 現在の戦略: {' / '.join(due)}", flush=True)
+    run_strategies(list(due), slot=f"{now.date()} {min(due.values())}")
+
+
+# 取得済みの足から {戦略名: {銘柄コード: シグナル}} を求める（EVAL_MODE に応じて一括 / 1銘柄ずつ）
+def evaluate_cache(cache, codes, plan):
+    if EVAL_MODE == "vectorized":
+        frames = {sym: cache[sym + ".T"].tail(plan.lookback) for sym in codes if sym + ".T" in cache}
+        signals = ShardedEvaluator().evaluate_many(frames, {name: STRATEGIES[name] for name in plan.names})
+        metrics.incr("symbols_processed", len(frames))
+        print(f"🧮 一括評価: {len(frames)}銘柄中 {sum(len(hits) for hits in signals.values())}件シグナル", flush=True)
+        return signals
+
+    indicators = IndicatorEngine()
+    signals = {name: {} for name in plan.names}
+    for sym in sorted(codes):
+        df = cache.get(sym + ".T")
+        if df is None or df.empty:
+            log(WARNING, "⚠️ %s のデータが取得できませんでした", sym)
+            continue
+
+        hits = evaluate_symbol(sym, df.tail(plan.lookback), plan, indicators)
+        metrics.incr("symbols_processed")
+        for name, signal in hits.items():
+            signals[name][sym] = signal
+        if not hits:
+            log(DEBUG, "🔍 %s → シグナルなし", sym)
+    return signals
+
+
+# その戦略を受け取る通知ONユーザーが1人もいなければ評価しない
+def wanted_strategies(names, symbol_index, strategy_index):
+    user_ids = {user.id for users in symbol_index.values() for user in users}
+    return [name for name in names if any(wants_strategy(strategy_index, uid, name) for uid in user_ids)]
+
+
+# 📧 ユーザーごとに、受け取る戦略のヒットをまとめて1通で通知（重複抑止の台帳は戦略ごと）
+def notify_user_hits(user, results, strategy_index, directory, dispatcher, ledgers):
+    hits = {}
+    for name in ledgers:
+        if wants_strategy(strategy_index, user.id, name):
+            hits[name] = [(sym, signals[name]) for sym, signals in results if name in signals]
+    notify_user_strategies(user, hits, directory, dispatcher, ledgers)
+
 
+def notify_strategies(signals, symbol_index, strategy_index, directory, dispatcher, ledgers):
+    # 未登録の銘柄名は通知する銘柄の分だけ先にまとめて問い合わせる
+    directory.ensure(sym for name in ledgers for sym in signals.get(name, {}) if sym in symbol_index)
+    per_user = {}
+    for name in ledgers:
+        for uid, (user, results) in fan_out(symbol_index, signals.get(name, {})).items():
+            if wants_strategy(strategy_index, uid, name):
+                per_user.setdefault(uid, (user, {}))[1][name] = results
+    for user, hits in per_user.values():
+        notify_user_strategies(user, hits, directory, dispatcher, ledgers)
+
+
+def load_ledgers(session, names):
+    return {name: NotificationLedger(session, name).load() for name in names}
+
+
+def save_ledgers(ledgers, dispatcher):
+    for ledger in ledgers.values():
+        ledger.save(dispatcher.stats.failed_recipients)
+    if ledgers:
+        # 古い記録の削除は戦略によらないので1回だけ
+        next(iter(ledgers.values())).evict()
+
+
+# スナップショット用に銘柄ごとのシグナルを1つの文言にまとめる
+def merge_signals(signals):
+    merged = {}
+    for name, hits in signals.items():
+        for sym, signal in hits.items():
+            merged.setdefault(sym, []).append(signal if len(signals) == 1 else f"{name}: {signal}")
+    return {sym: "\n".join(lines) for sym, lines in merged.items()}
+
+
+def run_strategy(strategy_name, slot=None):
+    return run_strategies([strategy_name], slot)
+
+
+# 🔀 async モードはシャードのリースを使わないので、分担させると全ワーカーが全銘柄を評価して同じ通知を送ってしまう
+def check_pipeline_mode(pipeline_mode, shard_count):
+    if pipeline_mode == "async" and shard_count > 1:
+        raise RuntimeError("PIPELINE_MODE=async は SHARD_COUNT>1 と併用できません（どちらかを外してください）")
+
+
+# 期限の来た戦略をまとめて1回で実行（取得 → 指標 → 全戦略の検出 → 通知）。SHARD_COUNT>1 なら DB のリースで複数ワーカーに分担
+def run_strategies(strategy_names, slot=None):
+    check_pipeline_mode(PIPELINE_MODE, SHARD_COUNT)
+    metrics.reset()
+    slot = slot or (datetime.utcnow() + timedelta(hours=9)).strftime("%Y-%m-%d %H:%M")
+    label = " + ".join(strategy_names)
     with app.app_context():
         Session = scoped_session(sessionmaker(bind=db.engine))
         db_session = Session()
 
-        users = db_session.query(User).filter_by(notify_enabled=True).all()
-        user_map, all_symbols = {}, set()
-
-        for u in users:
-            syms = [s.strip() for s in u.symbols.splitlines() if s.strip() and s[0].isdigit()]
-            user_map[u.id] = (u, syms)
-            all_symbols.update(syms)
-
-        symbols_to_fetch = [s + ".T" for s in all_symbols]
-        cache, access_count = {}, 0
-
-        for syms in batch(symbols_to_fetch, 10):
-            for sym in syms:
-                try:
-                    print(f"📥 Downloading: {sym}", flush=True)
-                    df = yf.download(sym, period="5d", interval="5m", progress=False)
-                    if not df.empty:
-                        cache[sym] = df
-                        access_count += 1
-                        if access_count % 100 == 0:
-                            print("🔄 100件取得、5秒待機", flush=True)
-                            time_module.sleep(5)
-                except Exception as e:
-                    print(f"❌ エラー({sym}): {e}", flush=True)
-
-        for uid, (user, symbols) in user_map.items():
-            results = []
-            for sym in symbols:
-                df = cache.get(sym + ".T")
-                if df is None or df.empty:
-                    print(f"⚠️ {sym} のデータが取得できませんでした", flush=True)
-                    continue
-            
-                df_debug = df.copy()
-            
-                # 👉 RSI確認
-                try:
-                    df_debug["RSI"] = ta.rsi(df_debug["Close"], length=14)
-                    latest_rsi = df_debug["RSI"].dropna().iloc[-1]
-                except:
-                    latest_rsi = "取得失敗"
-            
-                # 👉 MACD確認（改良版）
-                try:
-                    macd = ta.macd(df_debug["Close"])
-                    df_debug[["MACD", "Signal", "Hist"]] = macd
-                    df_macd = df_debug.dropna(subset=["MACD", "Signal"])
-                    if len(df_macd) >= 1:
-                        latest_macd = df_macd.iloc[-1]
-                        macd_val = latest_macd.MACD
-                        signal_val = latest_macd.Signal
-                    else:
-                        macd_val = signal_val = "NaN"
-                except Exception as e:
-                    macd_val = signal_val = f"ERR: {e}"
-
-            
-                # 👉 出来高平均と比率確認
-                try:
-                    df_debug["Vol_Avg"] = df_debug["Volume"].rolling(20).mean()
-                    latest_vol = df_debug.dropna().iloc[-1]
-                    vol_ratio = latest_vol["Volume"] / latest_vol["Vol_Avg"]
-                except:
-                    vol_ratio = "取得失敗"
-            
-                print(f"🔎 {sym} → RSI: {latest_rsi}, MACD: {macd_val}, Signal: {signal_val}, 出来高比: {vol_ratio:.2f}" if isinstance(vol_ratio, float) else f"🔎 {sym} → ログ取得失敗", flush=True)
-            
-                # 通常のシグナル検出処理
-                signal = None
-                if strategy_name == "オープニング逆張りスナイパー":
-                    signal = detect_rsi_stoch_signal(df)
-                elif strategy_name == "モーニングトレンドハンター":
-                    signal = detect_ma_rsi_signal(df)
-                elif strategy_name == "ボリュームライディングブレイカー":
-                    signal = detect_volume_rsi_breakout(df)
-                elif strategy_name == "サイレント・ゾーン・スキャナー":
-                    signal = detect_atr_low_volatility(df)
-                elif strategy_name == "リバーサル・シーカー":
-                    signal = detect_macd_reversal(df)
-                elif strategy_name == "クロージング・サージ・スナイパー":
-                    signal = detect_closing_surge(df)
-
-
-                if signal:
-                    results.append((sym, signal))
-                else:
-                    print(f"🔍 {sym} → シグナルなし", flush=True)
-
-            if results:
-                # 件名と本文を戦略別に切り替え（timestamp削除＆買いシグナル前提）
-                try:
-                    full = results[0][0] + ".T"
-                    name = yf.Ticker(full).info.get("longName", "名称不明")
-                except:
-                    name = "名称取得失敗"
-                url = f"https://finance.yahoo.co.jp/quote/{results[0][0]}.T"
-                symbol = results[0][0]
-                signal = results[0][1]
-            
-                if strategy_name == "オープニング逆張りスナイパー":
-                    subject = "【逆張りチャンス】寄付き直後の買いシグナル"
-                    body = f"""
-            【戦略】{strategy_name}
-            🔍 寄付き直後の逆張り買いシグナルが出ました！
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-                elif strategy_name == "モーニングトレンドハンター":
-                    subject = "【上昇トレンド開始】朝の上昇を先取り！"
-                    body = f"""
-            【戦略】{strategy_name}
-            📈 初動の上昇トレンドを捉える買いシグナルです！
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-                elif strategy_name == "ボリュームライディングブレイカー":
-                    subject = "【出来高急増】ブレイクアウトの兆し"
-                    body = f"""
-            【戦略】{strategy_name}
-            🔥 出来高急増＋トレンド形成中！買い圧力の高まりを示しています。
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-                elif strategy_name == "サイレント・ゾーン・スキャナー":
-                    subject = "【静寂の中の兆候】低ボラ状態からの上昇準備"
-                    body = f"""
-            【戦略】{strategy_name}
-            🧘 市場が静かな今、次の上昇に備えるチャンスを示しています。
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-                elif strategy_name == "リバーサル・シーカー":
-                    subject = "【反転サイン】底打ちの兆しを検出"
-                    body = f"""
-            【戦略】{strategy_name}
-            🔄 トレンド反転の兆候あり！今がエントリーの好機かもしれません。
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-                elif strategy_name == "クロージング・サージ・スナイパー":
-                    subject = "【引け前急騰】買いの勢いを捉えろ！"
-                    body = f"""
-            【戦略】{strategy_name}
-            🚀 引け前に出来高と価格が急上昇！買いのタイミングを知らせます。
-            
-            銘柄コード: {symbol}
-            内容: {signal}
-            銘柄名: {name}
-            Yahooファイナンス: {url}
-            """
-            
-                send_email(user.email, subject, body)
-                print(f"📧 {user.username} へ通知: {results}", flush=True)
-
+        db.create_all()
+        with metrics.timer("db.subscriptions"):
+            backfill_subscriptions(db_session)
+            symbol_index = build_symbol_index(db_session)
+            strategy_index = build_strategy_index(db_session)
+        # 📏 取得日数と評価に使う本数は、受け取るユーザーがいる戦略の要件の和から決める
+        plan = plan_strategies(wanted_strategies(strategy_names, symbol_index, strategy_index))
+        if not plan.names:
+            # 受け取るユーザーがいない実行枠は取得・評価・保存を一切しない
+            print(f"⏸ {label} を受け取るユーザーがいないためスキップ", flush=True)
+            db_session.close()
+            return
+
+        all_symbols = set(symbol_index)
+        provider = market_data_provider()
+        with metrics.timer("db.directory"):
+            directory = SymbolDirectory(db_session, lookup=provider.info)
+            directory.preload(all_symbols)
+
+        symbols_to_fetch = sorted(s + ".T" for s in all_symbols)
+        days = plan.days("5m")
+        fetcher = BatchFetcher(transport=provider.download, batch_size=FETCH_BATCH_SIZE,
+                               max_workers=FETCH_WORKERS, max_retries=FETCH_MAX_RETRIES,
+                               per_symbol_calls=getattr(provider, "per_symbol_calls", False))
+        bar_cache = BarCache(BAR_CACHE_PATH)
+        dispatcher = Dispatcher()
+
+        # 🔀 取得・評価・通知を重ねて実行するモード
+        if PIPELINE_MODE == "async":
+            indicators = IndicatorEngine()
+            ledgers = load_ledgers(db_session, plan.names)
+            signals = {name: {} for name in plan.names}
+
+            def evaluate(sym, df):
+                hits = evaluate_symbol(sym, df.tail(plan.lookback), plan, indicators)
+                for name, signal in hits.items():
+                    signals[name][sym] = signal
+                return hits
+
+            with metrics.timer("pipeline"):
+                AsyncPipeline(
+                    fetcher, bar_cache,
+                    evaluate=evaluate,
+                    notify=lambda user, results: notify_user_hits(user, results, strategy_index, directory,
+                                                                  dispatcher, ledgers),
+                    flush=dispatcher.flush,
+                    period=f"{days}d", days=days,
+                ).run(symbol_index)
+            save_ledgers(ledgers, dispatcher)
+            with metrics.timer("db.directory_refresh"):
+                directory.refresh()
+            with metrics.timer("snapshot"):
+                snapshot = compute_snapshot(bar_cache.load_store(symbols_to_fetch, "5m", days=days), all_symbols)
+            bar_cache.evict(BAR_RETENTION_DAYS)
+            bar_cache.close()
+            summary = save_run_summary(db_session, label)
+            save_snapshot(db_session, summary.id, label, snapshot, merge_signals(signals))
+            db_session.close()
+            return
+
+        # 🧩 シャード分担モード（同じ実行枠の全ワーカーが同じ BotRun に合流し、集約役1台だけが通知）
+        if SHARD_COUNT > 1:
+            coordinator = ShardCoordinator(db_session)
+            run = coordinator.ensure_run(label, slot, symbols_to_fetch, SHARD_COUNT)
+            snapshot, shard_signals = {}, {name: {} for name in plan.names}
+
+            # シャードの結果は銘柄ごとに {戦略名: シグナル} を JSON で保存する
+            def evaluate_shard(symbols, heartbeat):
+                with metrics.timer("fetch"):
+                    cache, failed = fetch_incremental(fetcher, bar_cache, symbols, interval="5m",
+                                                      period=f"{days}d", days=days)
+                metrics.incr("fetch_failures", len(failed))
+                heartbeat()  # 💓 取得に時間がかかってリースを失っていたら評価しない
+                codes = [s[:-2] for s in symbols]
+                with metrics.timer("evaluate"):
+                    signals = evaluate_cache(cache, codes, plan)
+                heartbeat()  # リースを失っていたらここで打ち切り（取り直した側が書く）
+                with metrics.timer("snapshot"):
+                    snapshot.update(compute_snapshot(cache, codes))
+                per_symbol = {}
+                for name, hits in signals.items():
+                    shard_signals[name].update(hits)
+                    for sym, signal in hits.items():
+                        per_symbol.setdefault(sym, {})[name] = signal
+                return {sym: json.dumps(hits, ensure_ascii=False) for sym, hits in per_symbol.items()}
+
+            def aggregate(results):
+                signals = {name: {} for name in plan.names}
+                for sym, encoded in results.items():
+                    for name, signal in json.loads(encoded).items():
+                        signals.setdefault(name, {})[sym] = signal
+                with metrics.timer("notify"):
+                    ledgers = load_ledgers(db_session, plan.names)
+                    notify_strategies(signals, symbol_index, strategy_index, directory, dispatcher, ledgers)
+                    dispatcher.flush()
+                    save_ledgers(ledgers, dispatcher)
+                # 通知を送った集約役だけが銘柄名を更新する
+                with metrics.timer("db.directory_refresh"):
+                    directory.refresh()
+
+            processed, aggregated = run_shards(coordinator, run, evaluate_shard, aggregate)
+            print(f"🧩 シャード処理 {processed}件{'・通知を集約' if aggregated else ''}（{coordinator.worker_id}）", flush=True)
+            bar_cache.evict(BAR_RETENTION_DAYS)
+            bar_cache.close()
+            summary = save_run_summary(db_session, label, status="ok" if aggregated else "shard")
+            save_snapshot(db_session, summary.id, label, snapshot, merge_signals(shard_signals))
+            db_session.close()
+            return
+
+        with metrics.timer("fetch"):
+            cache, failed = fetch_incremental(fetcher, bar_cache, symbols_to_fetch, interval="5m",
+                                              period=f"{days}d", days=days)
+            bar_cache.evict(BAR_RETENTION_DAYS)
+            bar_cache.close()
+        metrics.incr("fetch_failures", len(failed))
+        print(f"📦 取得完了: {len(cache)}/{len(symbols_to_fetch)}件（失敗{len(failed)}件）", flush=True)
+
+        with metrics.timer("evaluate"):
+            signals = evaluate_cache(cache, all_symbols, plan)
+        with metrics.timer("snapshot"):
+            snapshot = compute_snapshot(cache, all_symbols)
+
+        with metrics.timer("notify"):
+            ledgers = load_ledgers(db_session, plan.names)
+            notify_strategies(signals, symbol_index, strategy_index, directory, dispatcher, ledgers)
+            dispatcher.flush()
+            save_ledgers(ledgers, dispatcher)
+        with metrics.timer("db.directory_refresh"):
+            directory.refresh()
+
+        summary = save_run_summary(db_session, label)
+        save_snapshot(db_session, summary.id, label, snapshot, merge_signals(signals))
         db_session.close()
 
 if __name__ == "__main__":
+    check_pipeline_mode(PIPELINE_MODE, SHARD_COUNT)
     main_loop()
@@ -0,0 +1,140 @@
+import json
+import math
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import SignalSnapshot
+from vectorized import BarPanel, rolling_mean, rsi, macd, atr
+
+SNAPSHOT_BARS = int(os.getenv("SNAPSHOT_BARS", "120"))
+SNAPSHOT_WRITE_CHUNK = int(os.getenv("SNAPSHOT_WRITE_CHUNK", "500"))
+
+
+def _value(x):
+    x = float(x)
+    return round(x, 4) if math.isfinite(x) else None
+
+
+def _utc(ts):
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.to_pydatetime()
+
+
+# 📸 取得済みの足から銘柄ごとの最新指標を一括計算（{銘柄コード: (最終足の時刻, {指標: 値})}）
+def compute_snapshot(cache, codes, bars=SNAPSHOT_BARS):
+    frames = {}
+    for code in codes:
+        df = cache.get(code + ".T")
+        if df is not None and not df.empty:
+            frames[code] = df.tail(bars)
+    panel = BarPanel.from_frames(frames)
+    if len(panel) == 0:
+        return {}
+
+    line, hist, signal_line = macd(panel.close)
+    vol_avg = rolling_mean(panel.volume, 20)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol_ratio = np.where(vol_avg > 0, panel.volume / vol_avg, np.nan)
+    columns = {
+        "close": panel.close,
+        "volume": panel.volume,
+        "rsi14": rsi(panel.close),
+        "sma5": rolling_mean(panel.close, 5),
+        "sma10": rolling_mean(panel.close, 10),
+        "macd": line,
+        "macd_signal": signal_line,
+        "macd_hist": hist,
+        "atr14": atr(panel.high, panel.low, panel.close),
+        "volume_ratio20": vol_ratio,
+    }
+    last = {name: values[:, -1] for name, values in columns.items()}
+    return {
+        code: (_utc(frames[code].index[-1]), {name: _value(values[row]) for name, values in last.items()})
+        for row, code in enumerate(panel.symbols)
+    }
+
+
+# 📡 常駐モード用: ストリーミング状態（{銘柄コード: SymbolState}）から compute_snapshot と同じ形で作る
+def snapshot_from_states(states):
+    snapshot = {}
+    for code, state in states.items():
+        if state.last_ts is None:
+            continue
+        s = state.snapshot()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vol_ratio = s["volume"] / s["vol_avg20"] if s["vol_avg20"] > 0 else math.nan
+        snapshot[code] = (_utc(state.last_ts), {
+            "close": _value(s["close"]),
+            "volume": _value(s["volume"]),
+            "rsi14": _value(s["rsi"]),
+            "sma5": _value(s["sma5"]),
+            "sma10": _value(s["sma10"]),
+            "macd": _value(s["macd"]),
+            "macd_signal": _value(s["macd"] - s["macd_hist"]),
+            "macd_hist": _value(s["macd_hist"]),
+            "atr14": _value(s["atr"]),
+            "volume_ratio20": _value(vol_ratio),
+        })
+    return snapshot
+
+
+# 💾 銘柄ごとに1行へ上書き保存（シャード分担時は各ワーカーが担当銘柄ぶんだけ書く）
+def save_snapshot(session, run_id, strategy_name, snapshot, signals, now=None):
+    now = now or datetime.utcnow()
+    codes = sorted(snapshot)
+    try:
+        for i in range(0, len(codes), SNAPSHOT_WRITE_CHUNK):
+            chunk = codes[i:i + SNAPSHOT_WRITE_CHUNK]
+            session.query(SignalSnapshot).filter(SignalSnapshot.symbol.in_(chunk)).delete(synchronize_session=False)
+            session.add_all(
+                SignalSnapshot(symbol=code, run_id=run_id, strategy=strategy_name, as_of=snapshot[code][0],
+                               indicators=json.dumps(snapshot[code][1]), signal=signals.get(code), updated_at=now)
+                for code in chunk
+            )
+        session.commit()
+    except IntegrityError:
+        # 同じ銘柄を別の実行が同時に書いた（次の実行で揃う）
+        session.rollback()
+        print("⚠️ スナップショットの保存が競合したためスキップしました", flush=True)
+        return 0
+    return len(codes)
+
+
+# 🗃 JSON API 用のプロセス内キャッシュ（表の版が変わったときだけ表全体を読み直す）
+# 版は行数と run_id の合計。行は書き込むたびに新しい（より大きい）run_id で置き換わるので、
+# シャードのワーカーがどの順でコミットしても書き込みごとに必ず変わる（最大 run_id だけだと後着の低い ID を見逃す）
+class SnapshotCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.run_id = None
+        self.updated_at = None
+        self.rows = {}
+
+    def current(self, session):
+        count, total = session.query(func.count(SignalSnapshot.symbol),
+                                     func.coalesce(func.sum(SignalSnapshot.run_id), 0)).one()
+        version = f"{count}-{total}"
+        with self._lock:
+            if version != self.version:
+                rows = session.query(SignalSnapshot).all()
+                self.rows = {
+                    row.symbol: {
+                        "symbol": row.symbol,
+                        "strategy": row.strategy,
+                        "as_of": row.as_of.isoformat() + "Z" if row.as_of else None,
+                        "indicators": json.loads(row.indicators),
+                        "signal": row.signal,
+                    }
+                    for row in rows
+                }
+                self.updated_at = max((row.updated_at for row in rows), default=None)
+                self.run_id = max((row.run_id for row in rows), default=None)
+                self.version = version
+            return self.version, self.run_id, self.updated_at, self.rows
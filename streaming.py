@@ -0,0 +1,230 @@
+import copy
+import math
+from collections import deque
+
+NAN = float("nan")
+
+
+# pandas の ewm(...).mean()（ignore_na=False）を1本ずつ更新する版
+class StreamingEWM:
+    __slots__ = ("old_wt_factor", "new_wt", "adjust", "minp", "weighted", "old_wt", "nobs")
+
+    def __init__(self, alpha=None, span=None, adjust=True, min_periods=0):
+        com = (span - 1) / 2.0 if span is not None else 1.0 / alpha - 1
+        alpha = 1.0 / (1.0 + com)
+        self.old_wt_factor = 1.0 - alpha
+        self.new_wt = 1.0 if adjust else alpha
+        self.adjust = adjust
+        self.minp = max(min_periods, 1)
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, x):
+        is_obs = x == x
+        self.nobs += is_obs
+        if self.weighted == self.weighted:
+            self.old_wt *= self.old_wt_factor
+            if is_obs:
+                if self.weighted != x:
+                    self.weighted = (self.old_wt * self.weighted + self.new_wt * x) / (self.old_wt + self.new_wt)
+                self.old_wt = self.old_wt + self.new_wt if self.adjust else 1.0
+        elif is_obs:
+            self.weighted = x
+        return self.value
+
+    @property
+    def value(self):
+        return self.weighted if self.nobs >= self.minp else NAN
+
+
+# pandas_ta.ema 相当（最初の length 本の SMA を種にする）
+class StreamingEMA:
+    __slots__ = ("length", "seed", "ewm")
+
+    def __init__(self, length):
+        self.length = length
+        self.seed = []
+        self.ewm = StreamingEWM(span=length, adjust=False)
+
+    def update(self, x):
+        if self.seed is not None:
+            if x != x:
+                return NAN
+            self.seed.append(x)
+            if len(self.seed) < self.length:
+                return NAN
+            x = math.fsum(self.seed) / self.length
+            self.seed = None
+        return self.ewm.update(x)
+
+
+class RollingMean:
+    __slots__ = ("window", "total", "nans")
+
+    def __init__(self, length):
+        self.window = deque(maxlen=length)
+        self.total = 0.0
+        self.nans = 0
+
+    def update(self, x):
+        if len(self.window) == self.window.maxlen:
+            old = self.window[0]
+            if old == old:
+                self.total -= old
+            else:
+                self.nans -= 1
+        self.window.append(x)
+        if x == x:
+            self.total += x
+        else:
+            self.nans += 1
+        return self.value
+
+    @property
+    def value(self):
+        if len(self.window) < self.window.maxlen or self.nans:
+            return NAN
+        return self.total / len(self.window)
+
+
+class RollingExtreme:
+    __slots__ = ("window", "fn")
+
+    def __init__(self, length, fn=max):
+        self.window = deque(maxlen=length)
+        self.fn = fn
+
+    def update(self, x):
+        self.window.append(x)
+        return self.value
+
+    @property
+    def value(self):
+        if len(self.window) < self.window.maxlen:
+            return NAN
+        return self.fn(self.window)
+
+
+# 📡 1銘柄ぶんのストリーミング指標状態（新しい足ごとに O(1) で更新）
+class SymbolState:
+    def __init__(self):
+        self.last_ts = None
+        self.bars = 0
+        self.prev_close = NAN
+        self.close = self.high = self.low = self.volume = NAN
+        self.rsi_pos = StreamingEWM(alpha=1 / 14, min_periods=14)
+        self.rsi_neg = StreamingEWM(alpha=1 / 14, min_periods=14)
+        self.ema_fast = StreamingEMA(12)
+        self.ema_slow = StreamingEMA(26)
+        self.macd_signal = StreamingEMA(9)
+        self.macd = self.macd_hist = NAN
+        self.macd_valid = 0
+        self.atr = StreamingEWM(alpha=1 / 14, min_periods=14)
+        self.atr_history = deque(maxlen=10)
+        self.sma5 = RollingMean(5)
+        self.sma10 = RollingMean(10)
+        self.vol_avg10 = RollingMean(10)
+        self.vol_avg20 = RollingMean(20)
+        self.prior_high10 = RollingExtreme(10, max)
+        self.high14 = RollingExtreme(14, max)
+        self.low14 = RollingExtreme(14, min)
+        self.stoch_k = RollingMean(3)
+        self.stoch_d = RollingMean(3)
+        self.high_break_ref = NAN
+
+    def update(self, ts, open_, high, low, close, volume):
+        self.high_break_ref = self.prior_high10.value
+        self.prior_high10.update(high)
+
+        diff = close - self.prev_close
+        self.rsi_pos.update(0.0 if diff < 0 else diff)
+        self.rsi_neg.update(0.0 if diff > 0 else diff)
+
+        tr = NAN
+        if self.bars > 0:
+            tr = max(high - low, abs(high - self.prev_close), abs(self.prev_close - low))
+        self.atr_history.append(self.atr.update(tr))
+
+        fast, slow = self.ema_fast.update(close), self.ema_slow.update(close)
+        self.macd = fast - slow
+        signal = self.macd_signal.update(self.macd)
+        self.macd_hist = self.macd - signal
+        self.macd_valid += self.macd_hist == self.macd_hist
+
+        self.sma5.update(close)
+        self.sma10.update(close)
+        self.vol_avg10.update(volume)
+        self.vol_avg20.update(volume)
+        lowest, highest = self.low14.update(low), self.high14.update(high)
+        if lowest == lowest and highest == highest:
+            self.stoch_d.update(self.stoch_k.update(100 * (close - lowest) / ((highest - lowest) or 1e-16)))
+
+        self.prev_close = close
+        self.close, self.high, self.low, self.volume = close, high, low, volume
+        self.last_ts = ts
+        self.bars += 1
+
+    # 未確定足を試し更新するための複製（状態サイズは固定なので O(1)）
+    def peek(self, ts, open_, high, low, close, volume):
+        state = copy.deepcopy(self)
+        state.update(ts, open_, high, low, close, volume)
+        return state
+
+    @property
+    def rsi(self):
+        pos, neg = self.rsi_pos.value, self.rsi_neg.value
+        return 100 * pos / (pos + abs(neg))
+
+    def snapshot(self):
+        atr_ref = [v for v in list(self.atr_history)[:5] if v == v]
+        return {
+            "close": self.close,
+            "volume": self.volume,
+            "rsi": self.rsi,
+            "stoch_k": self.stoch_k.value,
+            "stoch_d": self.stoch_d.value,
+            "sma5": self.sma5.value,
+            "sma10": self.sma10.value,
+            "macd": self.macd,
+            "macd_hist": self.macd_hist,
+            "atr": self.atr.value,
+            "atr_ref": sum(atr_ref) / len(atr_ref) if atr_ref and len(self.atr_history) == 10 else NAN,
+            "vol_avg10": self.vol_avg10.value,
+            "vol_avg20": self.vol_avg20.value,
+            "prior_high10": self.high_break_ref,
+        }
+
+
+# ---- ストリーミング状態での戦略判定（run_bot.detect_* と同じ条件。run_bot.STRATEGIES から参照する） ----
+# 判定だけを返し、通知文言に値を入れる戦略は (判定, {値}) を返す
+
+def rsi_stoch_state(state):
+    # detect_rsi_stoch_signal は ta.stoch の先頭 NaN で常に None になるため合わせる
+    return False
+
+
+def ma_rsi_state(state):
+    s = state.snapshot()
+    return s["sma5"] >= s["sma10"] and s["rsi"] > 40
+
+
+def volume_rsi_breakout_state(state):
+    s = state.snapshot()
+    return s["volume"] > s["vol_avg10"] * 1.1 and s["rsi"] > 40 and s["close"] >= s["prior_high10"] * 0.995
+
+
+def atr_low_volatility_state(state):
+    s = state.snapshot()
+    return s["atr"] < s["atr_ref"] * 0.6
+
+
+def macd_reversal_state(state):
+    s = state.snapshot()
+    return state.macd_valid >= 2 and s["macd"] > s["macd_hist"]
+
+
+def closing_surge_state(state):
+    s = state.snapshot()
+    ratio = s["volume"] / s["vol_avg20"] if s["vol_avg20"] > 0 else 0
+    return ratio > 1.2, {"ratio": ratio}
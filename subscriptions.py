@@ -0,0 +1,107 @@
+from collections import defaultdict
+
+from sqlalchemy.exc import IntegrityError
+
+from models import User, Subscription, StrategySubscription
+
+
+# 登録銘柄テキストを銘柄コードのリストに変換（日本株コードのみ、重複除去・順序維持）
+def parse_symbols(text):
+    if not text:
+        return []
+    syms = [s.strip() for s in text.splitlines() if s.strip() and s[0].isdigit()]
+    return list(dict.fromkeys(syms))
+
+
+# User.symbols の内容を Subscription テーブルへ反映
+def sync_user_subscriptions(session, user):
+    wanted = set(parse_symbols(user.symbols))
+    current = {s.symbol for s in session.query(Subscription).filter_by(user_id=user.id)}
+    for sym in current - wanted:
+        session.query(Subscription).filter_by(user_id=user.id, symbol=sym).delete()
+    session.add_all(Subscription(user_id=user.id, symbol=sym) for sym in wanted - current)
+
+
+# 購読行がまだ無いユーザー（テーブル追加前の登録分）を一括で移行
+def backfill_subscriptions(session):
+    missing = (
+        session.query(User)
+        .outerjoin(Subscription, Subscription.user_id == User.id)
+        .filter(Subscription.user_id.is_(None), User.symbols.isnot(None))
+        .all()
+    )
+    for user in missing:
+        sync_user_subscriptions(session, user)
+    if missing:
+        try:
+            session.commit()
+        except IntegrityError:
+            # 別のワーカーが同時に移行済み
+            session.rollback()
+    return len(missing)
+
+
+# 🗂 通知ONユーザーの 銘柄→購読者 インデックスを作成
+def build_symbol_index(session):
+    rows = (
+        session.query(Subscription.symbol, User)
+        .join(User, User.id == Subscription.user_id)
+        .filter(User.notify_enabled.is_(True))
+        .order_by(Subscription.symbol, User.id)
+        .all()
+    )
+    index = defaultdict(list)
+    for sym, user in rows:
+        index[sym].append(user)
+    return dict(index)
+
+
+# 銘柄ごとの評価結果をユーザーごとの結果リストに展開
+def fan_out(symbol_index, signals):
+    per_user = {}
+    for sym, users in symbol_index.items():
+        signal = signals.get(sym)
+        if not signal:
+            continue
+        for user in users:
+            per_user.setdefault(user.id, (user, []))[1].append((sym, signal))
+    return per_user
+
+
+# ユーザーが選べる戦略（run_bot.STRATEGIES と同じ名前・順序。Web 側で run_bot を読み込まないためここに置く）
+STRATEGY_NAMES = (
+    "オープニング逆張りスナイパー",
+    "モーニングトレンドハンター",
+    "ボリュームライディングブレイカー",
+    "サイレント・ゾーン・スキャナー",
+    "リバーサル・シーカー",
+    "クロージング・サージ・スナイパー",
+)
+
+
+# 受け取る戦略を保存（全戦略または未選択なら行を消して「全戦略」に戻す）
+def sync_user_strategies(session, user, names):
+    wanted = {n for n in names if n in STRATEGY_NAMES}
+    if wanted == set(STRATEGY_NAMES):
+        wanted = set()
+    current = {s.strategy for s in session.query(StrategySubscription).filter_by(user_id=user.id)}
+    for name in current - wanted:
+        session.query(StrategySubscription).filter_by(user_id=user.id, strategy=name).delete()
+    session.add_all(StrategySubscription(user_id=user.id, strategy=name) for name in wanted - current)
+
+
+def user_strategies(session, user_id):
+    return {s.strategy for s in session.query(StrategySubscription).filter_by(user_id=user_id)}
+
+
+# 🗂 戦略を絞っているユーザーだけの ユーザーID→戦略集合（載っていないユーザーは全戦略）
+def build_strategy_index(session):
+    index = defaultdict(set)
+    for user_id, name in session.query(StrategySubscription.user_id, StrategySubscription.strategy):
+        index[user_id].add(name)
+    return dict(index)
+
+
+def wants_strategy(strategy_index, user_id, strategy_name):
+    names = strategy_index.get(user_id)
+    return names is None or strategy_name in names
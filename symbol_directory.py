@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import Security
+
+SECURITY_TTL_DAYS = int(os.getenv("SECURITY_TTL_DAYS", "30"))
+SECURITY_REFRESH_LIMIT = int(os.getenv("SECURITY_REFRESH_LIMIT", "200"))
+SECURITY_REFRESH_WORKERS = int(os.getenv("SECURITY_REFRESH_WORKERS", "4"))
+SECURITY_LOOKUP_LIMIT = int(os.getenv("SECURITY_LOOKUP_LIMIT", "50"))
+
+
+# 🌐 yfinance から銘柄メタデータを取得
+def yfinance_info(symbol):
+    import yfinance as yf
+
+    info = yf.Ticker(symbol + ".T").info
+    return {"name": info.get("longName"), "market": info.get("market"), "sector": info.get("sector")}
+
+
+# 📇 銘柄名ディレクトリ（起動時に DB からまとめて読み込み、実行中はメモリ参照のみ）
+# 未登録の銘柄はシグナルが出たものだけ通知前に ensure() で問い合わせ（1回あたり lookup_limit 件まで）、
+# 期限切れ・問い合わせきれなかった分の更新と DB への保存は通知の送信後に refresh() で行う
+class SymbolDirectory:
+    def __init__(self, session, lookup=yfinance_info, ttl_days=SECURITY_TTL_DAYS,
+                 refresh_limit=SECURITY_REFRESH_LIMIT, workers=SECURITY_REFRESH_WORKERS,
+                 lookup_limit=SECURITY_LOOKUP_LIMIT):
+        self.session = session
+        self.lookup = lookup
+        self.ttl = timedelta(days=ttl_days)
+        self.refresh_limit = refresh_limit
+        self.workers = workers
+        self.lookup_budget = lookup_limit
+        self.entries = {}
+        self.rows = {}
+        self.missing = set()
+        self.fetched = {}
+        self.deferred = []
+        self.stale = []
+
+    def preload(self, symbols, now=None):
+        now = now or datetime.utcnow()
+        symbols = sorted(set(symbols))
+        rows = {}
+        if symbols:
+            rows = {row.symbol: row for row in self.session.query(Security).filter(Security.symbol.in_(symbols))}
+        self.rows.update(rows)
+        self.entries.update({sym: (row.name, row.updated_at) for sym, row in rows.items()})
+
+        # 期限切れでも古い名前は使えるので、更新は送信後に refresh_limit 件まで
+        self.missing = {s for s in symbols if s not in rows}
+        expired = [s for s in symbols if s in rows and (rows[s].updated_at or datetime.min) < now - self.ttl]
+        self.stale = expired[:self.refresh_limit]
+        print(f"📇 銘柄名ディレクトリ: {len(self.entries)}件（未登録{len(self.missing)}件 / 期限切れ{len(expired)}件）",
+              flush=True)
+        return len(self.missing)
+
+    # 🔎 これから通知する銘柄のうち未登録のものだけ、その場で問い合わせる（DB には書かない）
+    def ensure(self, symbols, now=None):
+        targets = sorted({s for s in symbols if s in self.missing})
+        if not targets:
+            return 0
+        self.missing.difference_update(targets)
+        targets, overflow = targets[:max(self.lookup_budget, 0)], targets[max(self.lookup_budget, 0):]
+        self.deferred.extend(overflow)
+        self.lookup_budget -= len(targets)
+        if not targets:
+            return 0
+        now = now or datetime.utcnow()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            fetched = list(executor.map(self._safe_lookup, targets))
+        for sym, info in zip(targets, fetched):
+            if info is not None:
+                self.fetched[sym] = info
+                self.entries[sym] = (info.get("name"), now)
+        return len(targets)
+
+    # 🔄 ensure で取れた分を保存し、期限切れ・問い合わせきれなかった分を更新する（dispatcher.flush() の後に呼ぶ）
+    def refresh(self, now=None):
+        now = now or datetime.utcnow()
+        targets = (self.deferred + self.stale)[:self.refresh_limit]
+        self.deferred, self.stale = [], []
+        results = dict(self.fetched)
+        self.fetched = {}
+        if targets:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for sym, info in zip(targets, executor.map(self._safe_lookup, targets)):
+                    if info is not None:
+                        results[sym] = info
+        if not results:
+            return 0
+        for sym, info in results.items():
+            row = self.rows.get(sym) or Security(symbol=sym)
+            row.name, row.market, row.sector = info.get("name"), info.get("market"), info.get("sector")
+            row.updated_at = now
+            self.session.add(row)
+            self.rows[sym] = row
+            self.entries[sym] = (row.name, now)
+        try:
+            self.session.commit()
+        except IntegrityError:
+            # 複数ワーカーが同じ銘柄を同時に登録した場合は先に書いた側を採用（名前はメモリに取得済み）
+            self.session.rollback()
+        print(f"📇 銘柄名ディレクトリ更新: {len(results)}件", flush=True)
+        return len(results)
+
+    def _safe_lookup(self, symbol):
+        try:
+            return self.lookup(symbol)
+        except Exception as e:
+            print(f"❌ 銘柄情報取得エラー({symbol}): {e}", flush=True)
+            return None
+
+    # まだ名前を取れていない銘柄はコードをそのまま表示する
+    def name(self, symbol):
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return symbol
+        return entry[0] or "名称不明"
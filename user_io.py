@@ -0,0 +1,239 @@
+import csv
+import io
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from models import User, Subscription, StrategySubscription
+from subscriptions import parse_symbols, STRATEGY_NAMES
+
+USER_IO_BATCH_SIZE = int(os.getenv("USER_IO_BATCH_SIZE", "1000"))
+USER_IMPORT_HASH_WORKERS = int(os.getenv("USER_IMPORT_HASH_WORKERS", "4"))
+
+EXPORT_FIELDS = ["username", "email", "role", "notify_enabled", "symbols", "strategies"]
+ROLES = ("user", "admin")
+# 登録銘柄・戦略を空にするときの指定（CSV の空欄は「変更しない」扱い。JSON は空配列でも可）
+CLEAR_MARKER = "-"
+# パスワード未指定で作ったユーザー用（check_password_hash が常に False になる値。管理画面から設定する）
+UNUSABLE_PASSWORD = "!"
+
+
+# ---- エクスポート（id のキーセットで分割して読み、1行ずつ書き出す） ----
+
+# ORM オブジェクトではなく列のタプルで読む（セッションに溜めない）。受け取る戦略もバッチごとに1回で引く
+def iter_users(session, batch_size=USER_IO_BATCH_SIZE):
+    columns = (User.id, User.username, User.email, User.role, User.notify_enabled, User.symbols, User.password_hash)
+    last_id = 0
+    while True:
+        batch = session.query(*columns).filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not batch:
+            return
+        strategies = {}
+        for user_id, name in (session.query(StrategySubscription.user_id, StrategySubscription.strategy)
+                              .filter(StrategySubscription.user_id.in_([u.id for u in batch]))):
+            strategies.setdefault(user_id, []).append(name)
+        for user in batch:
+            yield user, sorted(strategies.get(user.id, []), key=STRATEGY_NAMES.index)
+        last_id = batch[-1].id
+
+
+# password_hash はコマンドラインから明示したときだけ含める（Web の書き出しには出さない）
+def _export_row(user, strategies, with_password_hash=False):
+    row = {
+        "username": user.username,
+        "email": user.email,
+        "role": user.role,
+        "notify_enabled": bool(user.notify_enabled),
+        "symbols": parse_symbols(user.symbols),
+        "strategies": strategies,
+    }
+    if with_password_hash:
+        row["password_hash"] = user.password_hash
+    return row
+
+
+def export_csv(session, with_password_hash=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS + ["password_hash"] if with_password_hash else EXPORT_FIELDS)
+    writer.writeheader()
+    for user, strategies in iter_users(session):
+        row = _export_row(user, strategies, with_password_hash)
+        row["symbols"] = " ".join(row["symbols"]) or CLEAR_MARKER
+        row["strategies"] = " ".join(row["strategies"]) or CLEAR_MARKER
+        row["notify_enabled"] = int(row["notify_enabled"])
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_json(session, with_password_hash=False):
+    yield "["
+    for i, (user, strategies) in enumerate(iter_users(session)):
+        row = _export_row(user, strategies, with_password_hash)
+        yield ("," if i else "") + "\n" + json.dumps(row, ensure_ascii=False)
+    yield "\n]\n"
+
+
+# ---- インポート ----
+
+def read_records(text, fmt):
+    if fmt == "json":
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("JSON はユーザーの配列で指定してください")
+        return records
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _split(value):
+    if isinstance(value, list):
+        value = "\n".join(str(v) for v in value)
+    return [v for v in re.split(r"[\s,;]+", str(value).strip()) if v]
+
+
+# 未指定・空欄は None（変更しない）、CLEAR_MARKER か空配列は [] （空にする）
+def _listed(record, key):
+    value = record.get(key)
+    if isinstance(value, list):
+        return _split(value)
+    if value is None or not str(value).strip():
+        return None
+    if str(value).strip() == CLEAR_MARKER:
+        return []
+    return _split(value)
+
+
+# 空なら全戦略
+def _strategies(names):
+    unknown = [n for n in names if n not in STRATEGY_NAMES]
+    if unknown:
+        raise ValueError(f"未知の戦略です: {', '.join(unknown)}")
+    return set() if set(names) == set(STRATEGY_NAMES) else set(names)
+
+
+# 入力1件を検証して User の属性に変換（None は「変更しない」）
+def normalize_record(record):
+    username = str(record.get("username") or "").strip()
+    if not username or len(username) > 50:
+        raise ValueError(f"ユーザー名が不正です: {username!r}")
+    role = str(record.get("role") or "").strip() or None
+    if role is not None and role not in ROLES:
+        raise ValueError(f"{username}: 権限は {' / '.join(ROLES)} のいずれかです")
+    email = record.get("email")
+    symbols = _listed(record, "symbols")
+    strategies = _listed(record, "strategies")
+    fields = {
+        "email": str(email).strip() or None if email is not None else None,
+        "role": role,
+        "notify_enabled": _flag(record["notify_enabled"]) if record.get("notify_enabled") not in (None, "") else None,
+        "symbols": "\n".join(symbols) if symbols is not None else None,
+        "password_hash": record.get("password_hash") or None,
+    }
+    return username, fields, _strategies(strategies) if strategies is not None else None, record.get("password") or None
+
+
+# 📥 ユーザーと登録銘柄をまとめて作成・更新（batch_size 件ごとに1回の照会と1回のコミット）
+# 平文パスワードのハッシュ化だけは重いのでスレッドで並列に行う
+def import_users(session, records, batch_size=USER_IO_BATCH_SIZE, hash_workers=USER_IMPORT_HASH_WORKERS):
+    report = {"created": 0, "updated": 0, "errors": []}
+    normalized = {}
+    for i, record in enumerate(records, 1):
+        try:
+            username, fields, strategies, password = normalize_record(record)
+        except (ValueError, TypeError, AttributeError) as e:
+            report["errors"].append(f"{i}行目: {e}")
+            continue
+        normalized[username] = (fields, strategies, password)  # 同じユーザー名は後の行を優先
+
+    plain = [(username, password) for username, (_, _, password) in normalized.items() if password]
+    if plain:
+        with ThreadPoolExecutor(max_workers=hash_workers) as executor:
+            hashes = executor.map(generate_password_hash, [password for _, password in plain])
+            for (username, _), hashed in zip(plain, hashes):
+                normalized[username][0]["password_hash"] = hashed
+
+    usernames = list(normalized)
+    for start in range(0, len(usernames), batch_size):
+        chunk = usernames[start:start + batch_size]
+        existing = {u.username: u for u in session.query(User).filter(User.username.in_(chunk))}
+        touched, chose = [], []
+        for username in chunk:
+            fields, strategies, _ = normalized[username]
+            user = existing.get(username)
+            if user is None:
+                user = User(username=username, role="user", notify_enabled=True, password_hash=UNUSABLE_PASSWORD)
+                session.add(user)
+                report["created"] += 1
+            else:
+                report["updated"] += 1
+            for key, value in fields.items():
+                if value is not None:
+                    setattr(user, key, value)
+            if fields["symbols"] is not None:
+                touched.append(user)
+            if strategies is not None:
+                chose.append((user, strategies))
+        session.flush()
+
+        # 登録銘柄を指定されたユーザーだけ購読行を作り直す
+        if touched:
+            ids = [u.id for u in touched]
+            session.query(Subscription).filter(Subscription.user_id.in_(ids)).delete(synchronize_session=False)
+            session.add_all(
+                Subscription(user_id=user.id, symbol=sym) for user in touched for sym in parse_symbols(user.symbols)
+            )
+        if chose:
+            ids = [u.id for u, _ in chose]
+            session.query(StrategySubscription).filter(StrategySubscription.user_id.in_(ids)).delete(
+                synchronize_session=False)
+            session.add_all(
+                StrategySubscription(user_id=user.id, strategy=name) for user, names in chose for name in names
+            )
+        session.commit()
+        print(f"📥 インポート {min(start + batch_size, len(usernames))}/{len(usernames)}件", flush=True)
+    return report
+
+
+# python user_io.py import users.csv / python user_io.py export users.json [--with-password-hash]
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    with_password_hash = "--with-password-hash" in argv
+    argv = [a for a in argv if a != "--with-password-hash"]
+    if len(argv) != 2 or argv[0] not in ("import", "export") or (with_password_hash and argv[0] != "export"):
+        print("使い方: python user_io.py import <ファイル.csv|.json> / "
+              "python user_io.py export <ファイル.csv|.json> [--with-password-hash]", flush=True)
+        return 2
+    command, path = argv
+    fmt = "json" if path.endswith(".json") else "csv"
+
+    from app import app, db
+
+    with app.app_context():
+        if command == "export":
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                for chunk in (export_json if fmt == "json" else export_csv)(db.session, with_password_hash):
+                    f.write(chunk)
+            print(f"📤 {path} に書き出しました", flush=True)
+            return 0
+        with open(path, encoding="utf-8-sig") as f:
+            report = import_users(db.session, read_records(f.read(), fmt))
+    print(f"✅ 作成{report['created']}件 / 更新{report['updated']}件 / エラー{len(report['errors'])}件", flush=True)
+    for error in report["errors"]:
+        print(f"⚠️ {error}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
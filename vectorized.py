@@ -0,0 +1,306 @@
+import sys
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+# 📊 銘柄×足 の2次元配列（足数の少ない銘柄は左側を NaN で埋めて右寄せ）
+class BarPanel:
+    def __init__(self, symbols, open_, high, low, close, volume, lengths):
+        self.symbols = symbols
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.lengths = lengths
+        self.memo = {}  # 複数戦略で共有する指標（RSI など）
+
+    @staticmethod
+    def shape_of(frames):
+        symbols = sorted(sym for sym, df in frames.items() if df is not None and not df.empty)
+        width = max((len(frames[sym]) for sym in symbols), default=0)
+        return symbols, (len(FIELDS), len(symbols), width)
+
+    # data に (5, 銘柄数, 足数) の配列を渡すとその領域に直接書き込む（共有メモリ用）
+    @classmethod
+    def from_frames(cls, frames, data=None):
+        symbols, shape = cls.shape_of(frames)
+        if data is None:
+            data = np.empty(shape)
+        data.fill(np.nan)
+        lengths = np.array([len(frames[sym]) for sym in symbols], dtype=np.int64)
+        width = shape[2]
+        for row, sym in enumerate(symbols):
+            df = frames[sym]
+            for i, col in enumerate(FIELDS):
+                data[i, row, width - len(df):] = df[col].to_numpy(dtype=np.float64)
+        return cls.from_array(symbols, data, lengths)
+
+    @classmethod
+    def from_array(cls, symbols, data, lengths):
+        return cls(symbols, *data, lengths)
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+# ---- pandas / pandas_ta と同じ計算手順を銘柄方向にまとめて実行 ----
+
+# pandas の Series.ewm(...).mean()（ignore_na=False）と同じ漸化式
+def ewm_mean(x, alpha=None, span=None, adjust=True, min_periods=0):
+    com = (span - 1) / 2.0 if span is not None else 1.0 / alpha - 1
+    alpha = 1.0 / (1.0 + com)
+    old_wt_factor = 1.0 - alpha
+    new_wt = 1.0 if adjust else alpha
+    minp = max(min_periods, 1)
+
+    out = np.full(x.shape, np.nan)
+    weighted = x[:, 0].copy()
+    nobs = (weighted == weighted).astype(np.int64)
+    old_wt = np.ones(len(x))
+    out[:, 0] = np.where(nobs >= minp, weighted, np.nan)
+    for i in range(1, x.shape[1]):
+        cur = x[:, i]
+        is_obs = cur == cur
+        nobs += is_obs
+        started = weighted == weighted
+        old_wt = np.where(started, old_wt * old_wt_factor, old_wt)
+        update = started & is_obs & (weighted != cur)
+        blended = (old_wt * weighted + new_wt * cur) / (old_wt + new_wt)
+        weighted = np.where(update, blended, weighted)
+        step = started & is_obs
+        old_wt = np.where(step, old_wt + new_wt if adjust else 1.0, old_wt)
+        weighted = np.where(~started & is_obs, cur, weighted)
+        out[:, i] = np.where(nobs >= minp, weighted, np.nan)
+    return out
+
+
+def _window(x, length, fn):
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] >= length:
+        out[:, length - 1:] = fn(sliding_window_view(x, length, axis=1), axis=-1)
+    return out
+
+
+def rolling_mean(x, length):
+    return _window(x, length, np.mean)
+
+
+def rolling_max(x, length):
+    return _window(x, length, np.max)
+
+
+def rolling_min(x, length):
+    return _window(x, length, np.min)
+
+
+def shift(x, n=1):
+    out = np.full(x.shape, np.nan)
+    out[:, n:] = x[:, :-n]
+    return out
+
+
+def rsi(close, length=14):
+    diff = close - shift(close)
+    positive = np.where(diff < 0, 0.0, diff)
+    negative = np.where(diff > 0, 0.0, diff)
+    pos_avg = ewm_mean(positive, alpha=1.0 / length, min_periods=length)
+    neg_avg = ewm_mean(negative, alpha=1.0 / length, min_periods=length)
+    return 100 * pos_avg / (pos_avg + np.abs(neg_avg))
+
+
+# pandas_ta.ema（先頭 length 本の SMA を種にした adjust=False の EMA）
+def ema(x, length):
+    seeded = np.full(x.shape, np.nan)
+    for row in range(len(x)):
+        valid = np.flatnonzero(~np.isnan(x[row]))
+        if len(valid) < length:
+            continue
+        first = valid[0]
+        seeded[row, first + length - 1] = np.mean(x[row, first:first + length])
+        seeded[row, first + length:] = x[row, first + length:]
+    return ewm_mean(seeded, span=length, adjust=False)
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return line, line - signal_line, signal_line
+
+
+# pandas_ta.non_zero_range（1本でも値幅0があれば系列全体に epsilon を足す）
+def non_zero_range(high, low):
+    diff = high - low
+    has_zero = (diff == 0).any(axis=1, keepdims=True)
+    return np.where(has_zero, diff + sys.float_info.epsilon, diff)
+
+
+def stoch(high, low, close, k=14, d=3, smooth_k=3):
+    lowest = rolling_min(low, k)
+    highest = rolling_max(high, k)
+    raw = 100 * (close - lowest) / non_zero_range(highest, lowest)
+    stoch_k = rolling_mean(raw, smooth_k)
+    stoch_d = rolling_mean(stoch_k, d)
+    return raw, stoch_k, stoch_d
+
+
+def atr(high, low, close, length=14):
+    prev_close = shift(close)
+    ranges = np.stack([non_zero_range(high, low), high - prev_close, prev_close - low])
+    tr = np.fmax.reduce(np.abs(ranges), axis=0)
+    first = np.argmax(~np.isnan(close), axis=1)
+    tr[np.arange(len(tr)), first] = np.nan
+    return ewm_mean(tr, alpha=1.0 / length, min_periods=length)
+
+
+def _last(x):
+    return x[:, -1]
+
+
+def _rsi(panel):
+    if "rsi" not in panel.memo:
+        panel.memo["rsi"] = rsi(panel.close)
+    return panel.memo["rsi"]
+
+
+def _finite(*arrays):
+    return np.logical_and.reduce([~np.isnan(a) for a in arrays])
+
+
+# ---- 戦略ごとのシグナルマスク（検出関数と同じ判定） ----
+
+def rsi_stoch_mask(panel):
+    r = _last(_rsi(panel))
+    raw, stoch_k, stoch_d = stoch(panel.high, panel.low, panel.close)
+    # detect_rsi_stoch_signal は ta.stoch の結果に NaN が1つでもあれば None を返す
+    started = np.maximum.accumulate(~np.isnan(raw), axis=1)
+    has_nan = (started & (np.isnan(stoch_k) | np.isnan(stoch_d))).any(axis=1) | ~started[:, -1]
+    k_last = _last(stoch_k)
+    return ~has_nan & _finite(r, k_last) & (r < 50) & (k_last < 50)
+
+
+def ma_rsi_mask(panel):
+    sma5 = _last(rolling_mean(panel.close, 5))
+    sma10 = _last(rolling_mean(panel.close, 10))
+    r = _last(_rsi(panel))
+    return _finite(sma5, sma10, r) & (sma5 >= sma10) & (r > 40)
+
+
+def volume_rsi_breakout_mask(panel):
+    r = _last(_rsi(panel))
+    vol_avg = _last(rolling_mean(panel.volume, 10))
+    prior_high = _last(rolling_max(shift(panel.high), 10))
+    vol = _last(panel.volume)
+    high_break = _last(panel.close) >= prior_high * 0.995
+    return _finite(r, vol_avg) & (vol > vol_avg * 1.1) & (r > 40) & high_break
+
+
+def atr_low_volatility_mask(panel):
+    a = atr(panel.high, panel.low, panel.close)
+    window = a[:, -10:-5]
+    counts = (~np.isnan(window)).sum(axis=1)
+    ref = np.where(counts > 0, np.nansum(window, axis=1) / np.maximum(counts, 1), np.nan)
+    return _last(a) < ref * 0.6
+
+
+def macd_reversal_mask(panel):
+    line, hist, _ = macd(panel.close)
+    valid = ~np.isnan(line) & ~np.isnan(hist)
+    enough = (valid.sum(axis=1) >= 2) & (panel.lengths >= 26)
+    # 既存の検出関数は ta.macd の2列目（ヒストグラム）を "Signal" として比較している
+    return enough & valid[:, -1] & (_last(line) > _last(hist))
+
+
+def closing_surge_ratio(panel):
+    vol_avg = _last(rolling_mean(panel.volume, 20))
+    vol = _last(panel.volume)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(vol_avg > 0, vol / vol_avg, 0.0)
+
+
+# 通知文言に倍率を入れるので (マスク, {値: 配列}) を返す
+def closing_surge_mask(panel):
+    ratio = closing_surge_ratio(panel)
+    return ratio > 1.2, {"ratio": ratio}
+
+
+# 🚀 全銘柄を一括評価し {銘柄: 通知文言} を返す（strategy は run_bot.STRATEGIES の要素）
+def evaluate_panel(panel, strategy):
+    if len(panel) == 0:
+        return {}
+    result = strategy.vectorized(panel)
+    mask, values = result if isinstance(result, tuple) else (result, {})
+    return {
+        panel.symbols[i]: strategy.message.format(**{key: value[i] for key, value in values.items()})
+        for i in np.flatnonzero(mask)
+    }
+
+
+# 同じパネルで複数の戦略を評価（strategies は {戦略名: Strategy}。結果は {戦略: {銘柄: 通知文言}}。共通の指標は1回だけ計算）
+def evaluate_panel_many(panel, strategies):
+    return {name: evaluate_panel(panel, strategy) for name, strategy in strategies.items()}
+
+
+# ---- 全足ぶんのシグナル（バックテスト用。検出関数の判定を「各足が最新足だったら」で一括評価） ----
+# 指標はすべて過去方向にしか依存しないので、全期間で1回計算した値の t 列目が t 時点の検出結果になる
+# （non_zero_range の epsilon 補正だけは系列全体で決まるが、影響は 1e-16 程度）
+
+def _cached(memo, key, compute):
+    if key not in memo:
+        memo[key] = compute()
+    return memo[key]
+
+
+def _series_rsi(panel, memo):
+    return _cached(memo, "rsi", lambda: rsi(panel.close))
+
+
+def rsi_stoch_signals(panel, memo):
+    r = _series_rsi(panel, memo)
+    raw, stoch_k, stoch_d = stoch(panel.high, panel.low, panel.close)
+    # 検出関数と同じく、それまでのストキャスに NaN が1つでもあれば発火しない（現状は常に不発）
+    started = np.maximum.accumulate(~np.isnan(raw), axis=1)
+    has_nan = np.maximum.accumulate(started & (np.isnan(stoch_k) | np.isnan(stoch_d)), axis=1)
+    return started & ~has_nan & (r < 50) & (stoch_k < 50)
+
+
+def ma_rsi_signals(panel, memo):
+    sma5 = rolling_mean(panel.close, 5)
+    sma10 = rolling_mean(panel.close, 10)
+    return (sma5 >= sma10) & (_series_rsi(panel, memo) > 40)
+
+
+def volume_rsi_breakout_signals(panel, memo):
+    vol_avg = rolling_mean(panel.volume, 10)
+    prior_high = rolling_max(shift(panel.high), 10)
+    return (panel.volume > vol_avg * 1.1) & (_series_rsi(panel, memo) > 40) & (panel.close >= prior_high * 0.995)
+
+
+def atr_low_volatility_signals(panel, memo):
+    a = atr(panel.high, panel.low, panel.close)
+    # atr.iloc[-10:-5].mean()（NaN を除いた平均）を各足について計算
+    window = shift(a, 5)
+    valid = ~np.isnan(window)
+    total = rolling_mean(np.where(valid, window, 0.0), 5)
+    counts = rolling_mean(valid.astype(np.float64), 5)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ref = np.where(counts > 0, total / counts, np.nan)
+    return a < ref * 0.6
+
+
+def macd_reversal_signals(panel, memo):
+    line, hist, _ = macd(panel.close)
+    valid = ~np.isnan(line) & ~np.isnan(hist)
+    bars_seen = np.cumsum(~np.isnan(panel.close), axis=1)
+    enough = (np.cumsum(valid, axis=1) >= 2) & (bars_seen >= 26)
+    return enough & valid & (line > hist)
+
+
+def closing_surge_signals(panel, memo):
+    vol_avg = rolling_mean(panel.volume, 20)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(vol_avg > 0, panel.volume / vol_avg, 0.0)
+    return ratio > 1.2